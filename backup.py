@@ -0,0 +1,300 @@
+import argparse
+import io
+import json
+import logging
+import os
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import execute_values
+
+import db_config
+from db_config import configure, get_connection, release_connection, sync_landmark_sequence
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Строк в одной части landmarks/NNNNN.jsonl: части восстанавливаются параллельно
+PART_ROWS = 5000
+
+# Строк в одной транзакции при восстановлении
+RESTORE_PAGE = 500
+
+# Сколько раз повторять пачку после взаимной блокировки на счётчиках landmark_stats
+RESTORE_RETRIES = 5
+
+BACKUP_COLUMNS = (
+    'id', 'name', 'address', 'category', 'description', 'history',
+    'longitude', 'latitude', 'images_name', 'photo', 'created_at', 'updated_at', 'deleted_at'
+)
+
+def manifest_path(archive_path: str) -> str:
+    """Manifest copy next to the archive, used as the base of the next incremental backup"""
+    return f"{archive_path}.manifest.json"
+
+def load_manifest(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported backup manifest version in {path}: {manifest.get('version')}")
+    return manifest
+
+def add_bytes(tar: tarfile.TarFile, name: str, data: bytes, mtime: Optional[float] = None):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(mtime if mtime is not None else time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+def encode_row(row) -> str:
+    record = dict(zip(BACKUP_COLUMNS, row))
+    for column in ('created_at', 'updated_at', 'deleted_at'):
+        if record[column] is not None:
+            record[column] = record[column].isoformat()
+    return json.dumps(record, ensure_ascii=False)
+
+def create_backup(out_path: str, since: Optional[str] = None) -> dict:
+    """Write landmark rows and their images from one consistent snapshot into a tar.gz
+
+    Rows are read through a server-side cursor inside a REPEATABLE READ
+    transaction and written in parts, so memory use does not grow with the
+    table. With `since` (a previous manifest) only images whose size or mtime
+    changed are stored; the rest are referenced from earlier archives.
+    """
+    configure()
+    base = load_manifest(since) if since else None
+    backend = get_storage()
+    backup_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    started = time.monotonic()
+
+    conn = psycopg2.connect(**db_config.DB_CONFIG)
+    conn.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    tmp_path = f"{out_path}.tmp"
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT now(), txid_current_snapshot()::text")
+            snapshot_at, snapshot = cur.fetchone()
+
+        images = {}
+        parts = []
+        rows = 0
+        with tarfile.open(tmp_path, 'w:gz') as tar:
+            with conn.cursor(name='landmark_backup') as cur:
+                cur.itersize = PART_ROWS
+                cur.execute("""
+                    SELECT id, name, address, category, description, history,
+                           ST_X(location::geometry), ST_Y(location::geometry),
+                           images_name, encode(photo, 'base64'),
+                           created_at, updated_at, deleted_at
+                    FROM landmark
+                    ORDER BY id
+                """)
+                while True:
+                    chunk = cur.fetchmany(PART_ROWS)
+                    if not chunk:
+                        break
+                    part_name = f"landmarks/{len(parts):05d}.jsonl"
+                    add_bytes(tar, part_name, '\n'.join(encode_row(row) for row in chunk).encode('utf-8'))
+                    parts.append(part_name)
+                    rows += len(chunk)
+                    for row in chunk:
+                        # Файлы удалённых записей тоже сохраняются: restore возвращает и надгробия
+                        if row[8]:
+                            images[row[8]] = None
+
+            # Файлы читаются, пока снимок строк ещё открыт; save_photo пишет файл раньше строки,
+            # поэтому каждая строка снимка находит свой файл
+            included = 0
+            missing = []
+            base_images = base['images'] if base else {}
+            for name in sorted(images):
+                stored = backend.stat(name)
+                if stored is None:
+                    missing.append(name)
+                    continue
+                previous = base_images.get(name)
+                if previous and previous['size'] == stored.size and previous['mtime'] == stored.mtime:
+                    images[name] = previous
+                    continue
+                add_bytes(tar, f"images/{name}", backend.load(name), stored.mtime)
+                images[name] = {'size': stored.size, 'mtime': stored.mtime, 'archive': backup_id}
+                included += 1
+
+            manifest = {
+                'version': FORMAT_VERSION,
+                'id': backup_id,
+                'base': base['id'] if base else None,
+                'chain': (base['chain'] if base else []) + [backup_id],
+                'snapshot_at': snapshot_at.isoformat(),
+                'snapshot': snapshot,
+                'landmarks': rows,
+                'parts': parts,
+                'images': {name: info for name, info in images.items() if info is not None},
+                'missing_images': missing,
+            }
+            add_bytes(tar, 'manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        conn.rollback()
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, out_path)
+    with open(manifest_path(out_path), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    kind = f"incremental on top of {manifest['base']}" if base else "full"
+    logger.info(
+        f"Backup {backup_id} ({kind}) written to {out_path} in {time.monotonic() - started:.1f}s: "
+        f"{rows} landmarks, {included} of {len(manifest['images'])} images included"
+    )
+    if missing:
+        logger.warning(f"{len(missing)} referenced image(s) were missing from storage: {', '.join(missing[:20])}")
+    return manifest
+
+def restore_page(records: List[dict]):
+    """Upsert a page of landmark rows in one transaction, retrying after deadlocks"""
+    values = [
+        (
+            r['id'], r['name'], r['address'], r['category'], r['description'], r['history'],
+            r['longitude'], r['longitude'], r['latitude'],
+            r['images_name'], r['photo'], r['created_at'], r['deleted_at']
+        )
+        for r in records
+    ]
+    for attempt in range(1, RESTORE_RETRIES + 1):
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO landmark (id, name, address, category, description, history,
+                                          location, images_name, photo, created_at, deleted_at)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        address = EXCLUDED.address,
+                        category = EXCLUDED.category,
+                        description = EXCLUDED.description,
+                        history = EXCLUDED.history,
+                        location = EXCLUDED.location,
+                        images_name = EXCLUDED.images_name,
+                        photo = EXCLUDED.photo,
+                        created_at = EXCLUDED.created_at,
+                        deleted_at = EXCLUDED.deleted_at
+                """, values, template="""(
+                    %s, %s, %s, %s, %s, %s,
+                    CASE WHEN %s IS NULL THEN NULL ELSE ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography END,
+                    %s, decode(%s, 'base64'), %s::timestamptz, %s::timestamptz
+                )""")
+            conn.commit()
+            return len(values)
+        except extensions.TransactionRollbackError as e:
+            # Параллельные пачки обновляют общие строки счётчиков в разном порядке
+            conn.rollback()
+            if attempt == RESTORE_RETRIES:
+                raise
+            logger.warning(f"Restore page rolled back ({e.pgcode}), retrying")
+            time.sleep(0.1 * attempt)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            release_connection(conn)
+
+def restore_part(data: bytes) -> int:
+    records = [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+    restored = 0
+    for i in range(0, len(records), RESTORE_PAGE):
+        restored += restore_page(records[i:i + RESTORE_PAGE])
+    return restored
+
+def drain(futures: dict, counts: dict):
+    for future in as_completed(futures):
+        kind, name = futures[future]
+        try:
+            counts[kind] += future.result()
+        except Exception as e:
+            counts['failed'] += 1
+            logger.error(f"Failed to restore {name}: {e}")
+    futures.clear()
+
+def save_image(backend, name: str, data: bytes) -> int:
+    backend.save(name, data)
+    return 1
+
+def restore_backup(archives: List[str], workers: int = 4) -> dict:
+    """Restore a full backup followed by its incremental backups, oldest first
+
+    Rows come from the newest archive, images from all of them with later
+    archives overriding earlier ones. Landmark parts and image writes run in
+    parallel; archives themselves are applied one after another.
+    """
+    configure()
+    backend = get_storage()
+    counts = {'landmarks': 0, 'images': 0, 'failed': 0}
+    manifests = []
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, archive in enumerate(archives):
+            restore_rows = index == len(archives) - 1
+            futures = {}
+            # Поточное чтение: архив не распаковывается на диск целиком
+            with tarfile.open(archive, 'r|gz') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    data = tar.extractfile(member).read()
+                    if member.name == 'manifest.json':
+                        manifests.append(json.loads(data))
+                    elif member.name.startswith('landmarks/'):
+                        if restore_rows:
+                            futures[executor.submit(restore_part, data)] = ('landmarks', member.name)
+                    elif member.name.startswith('images/'):
+                        name = member.name[len('images/'):]
+                        futures[executor.submit(save_image, backend, name, data)] = ('images', name)
+                    if len(futures) >= workers * 4:
+                        drain(futures, counts)
+            drain(futures, counts)
+            logger.info(f"Applied archive {archive}")
+
+    sync_landmark_sequence()
+
+    if manifests:
+        latest = manifests[-1]
+        applied = {manifest['id'] for manifest in manifests}
+        missing_archives = sorted(set(latest['chain']) - applied)
+        if missing_archives:
+            logger.warning(f"Backups {', '.join(missing_archives)} of the chain were not restored, some images may be missing")
+        if counts['landmarks'] != latest['landmarks']:
+            logger.warning(f"Restored {counts['landmarks']} landmarks, manifest lists {latest['landmarks']}")
+
+    logger.info(f"Restore finished in {time.monotonic() - started:.1f}s: {counts}")
+    return counts
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Резервная копия достопримечательностей и изображений")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help="создать архив")
+    create_parser.add_argument('out', help="путь к архиву .tar.gz")
+    create_parser.add_argument('--since', help="манифест предыдущей копии (<архив>.manifest.json) для инкрементальной копии")
+    restore_parser = subparsers.add_parser('restore', help="восстановить из архивов")
+    restore_parser.add_argument('archives', nargs='+', help="полная копия и затем инкрементальные, по порядку")
+    restore_parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        create_backup(args.out, args.since)
+    elif args.command == 'restore':
+        result = restore_backup(args.archives, args.workers)
+        if result['failed']:
+            raise SystemExit(1)
@@ -0,0 +1,123 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from typing import List, Optional, Tuple
+
+from db_config import configure, get_connection, release_connection
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки по умолчанию
+DEFAULT_BATCH = 500
+
+def encode_cursor(change_xid: int, landmark_id: int) -> str:
+    """Build an opaque cursor from the last seen (change_xid, id) pair"""
+    return f"{change_xid}|{landmark_id}"
+
+def decode_cursor(cursor: Optional[str]) -> Tuple[int, int]:
+    """Parse a cursor, an empty cursor means the beginning of the feed"""
+    if not cursor:
+        return 0, 0
+    try:
+        change_xid, landmark_id = cursor.rsplit('|', 1)
+        landmark_id = int(landmark_id)
+    except ValueError:
+        raise ValueError(f"Invalid change feed cursor: {cursor!r}")
+    try:
+        return int(change_xid), landmark_id
+    except ValueError:
+        # Курсор старого формата (updated_at|id) не переводится в номер транзакции:
+        # лента отдаётся заново с начала, повторы для потребителя безвредны
+        logger.warning(f"Change feed cursor {cursor!r} has the old format, restarting from the beginning")
+        return 0, 0
+
+def batch_size() -> int:
+    return int(os.getenv('CHANGE_FEED_BATCH', DEFAULT_BATCH))
+
+def changes_since(cursor: Optional[str], limit: Optional[int] = None) -> Tuple[List[dict], Optional[str]]:
+    """Return up to `limit` landmarks changed after the cursor and the cursor for the next call
+
+    Deleted landmarks are returned as tombstones with 'deleted': True and no data fields.
+    Rows are ordered by the transaction that last changed them, and only rows of
+    transactions older than every running one are returned: a slow transaction
+    holds the feed back until it ends instead of being skipped.
+    """
+    if limit is None:
+        limit = batch_size()
+    xid_after, last_id = decode_cursor(cursor)
+    # Читаем с primary: задержка реплики могла бы сдвинуть курсор мимо ещё не реплицированных строк
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, name, address, category, description, history,
+                       ST_X(location::geometry) as longitude,
+                       ST_Y(location::geometry) as latitude,
+                       images_name, created_at, updated_at, deleted_at, change_xid
+                FROM landmark
+                WHERE (change_xid, id) > (%s, %s)
+                  AND change_xid < txid_snapshot_xmin(txid_current_snapshot())
+                ORDER BY change_xid, id
+                LIMIT %s
+            """, (xid_after, last_id, limit))
+            rows = cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error reading change feed after cursor {cursor!r}: {e}")
+        raise
+    finally:
+        release_connection(conn)
+
+    changes = []
+    for row in rows:
+        if row[11] is not None:
+            changes.append({
+                'id': row[0],
+                'deleted': True,
+                'updated_at': row[10].isoformat(),
+                'deleted_at': row[11].isoformat(),
+            })
+            continue
+        changes.append({
+            'id': row[0],
+            'deleted': False,
+            'name': row[1],
+            'address': row[2],
+            'category': row[3],
+            'description': row[4],
+            'history': row[5],
+            'longitude': row[6],
+            'latitude': row[7],
+            'images_name': row[8],
+            'created_at': row[9].isoformat(),
+            'updated_at': row[10].isoformat(),
+        })
+
+    next_cursor = encode_cursor(rows[-1][12], rows[-1][0]) if rows else cursor
+    logger.info(f"Change feed returned {len(changes)} change(s) after cursor {cursor!r}")
+    return changes, next_cursor
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка изменений landmark после курсора в формате JSON Lines")
+    parser.add_argument('cursor', nargs='?', default='', help="курсор из предыдущего запуска (пусто - с начала)")
+    parser.add_argument('--batch', type=int, default=None, help="размер пачки")
+    parser.add_argument('--once', action='store_true', help="выгрузить только одну пачку")
+    args = parser.parse_args()
+
+    configure()
+    batch = args.batch or batch_size()
+    cursor = args.cursor
+    while True:
+        changes, cursor = changes_since(cursor, batch)
+        for change in changes:
+            print(json.dumps(change, ensure_ascii=False))
+        if args.once or len(changes) < batch:
+            break
+
+    # Курсор для следующего запуска выводится в stderr, чтобы не смешиваться с данными
+    print(cursor or '', file=sys.stderr)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,78 @@
+import logging
+import random
+import threading
+import time
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency that is known to be down"""
+
+class CircuitBreaker:
+    """Classic three-state breaker
+
+    After `failure_threshold` consecutive failures the breaker opens and callers
+    fail fast for `reset_timeout` seconds. Then a single caller is let through
+    as a probe: its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.probe_started_at = 0.0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not be attempted"""
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            # Зависший или потерянный пробный вызов не должен держать размыкатель вечно
+            probe_stale = time.monotonic() - self.probe_started_at >= self.reset_timeout
+            if self.state == HALF_OPEN and (not self.probe_in_flight or probe_stale):
+                self.probe_in_flight = True
+                self.probe_started_at = time.monotonic()
+                logger.info(f"Circuit {self.name} is half-open, probing")
+                return
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit {self.name} closed, dependency is back")
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self, error=None):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.error(f"Circuit {self.name} opened after {self.failures} failure(s): {error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def is_open(self) -> bool:
+        """Whether callers are currently failing fast (a due probe counts as closed)"""
+        with self.lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+def backoff_delays(attempts: int, base: float = 0.1, cap: float = 2.0) -> Iterator[float]:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**n)) before retry n"""
+    for attempt in range(attempts):
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
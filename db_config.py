@@ -1,97 +1,449 @@
 import psycopg2
 from psycopg2 import pool
+import asyncio
 import logging
-from typing import Optional, List, Tuple
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, List, Sequence, Tuple
 from datetime import datetime
 import os
 import shutil
 from telegram import Bot, Update
 from dotenv import load_dotenv
 from telegram.ext import ContextTypes
+import models
+import query_stats
+import storage
+from circuit_breaker import CircuitBreaker, CircuitOpenError, backoff_delays
+from query_stats import TimedCursor
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Получаем путь к директории текущего файла
 current_dir = os.path.dirname(os.path.abspath(__file__))
 env_path = os.path.join(current_dir, '.env')
 
-# Загрузка переменных окружения
-logger.info(f"Loading .env file from: {env_path}")
-load_dotenv(env_path)
-
-# Проверка загрузки переменных окружения
-logger.info("Checking environment variables...")
-for var in ['DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST', 'DB_PORT']:
-    value = os.getenv(var)
-    logger.info(f"{var}: {'Set' if value else 'Not set'}")
-
-# Database configuration from environment variables
-DB_CONFIG = {
-    'dbname': os.getenv('DB_NAME'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'host': os.getenv('DB_HOST', 'db'),  # Используем 'db' как значение по умолчанию
-    'port': os.getenv('DB_PORT', '5432'),
-    'client_encoding': 'utf8'
-}
-
-# Проверка наличия всех необходимых переменных окружения для БД
-required_db_vars = ['DB_NAME', 'DB_USER', 'DB_PASSWORD']
-missing_vars = [var for var in required_db_vars if not os.getenv(var)]
-if missing_vars:
-    logger.error(f"Missing required database environment variables: {', '.join(missing_vars)}")
-    raise ValueError(f"Missing required database environment variables: {', '.join(missing_vars)}")
+# Database configuration, заполняется в configure()
+DB_CONFIG = {}
+
+# Получаем путь к директории для изображений из .env (заполняется в configure())
+IMAGES_DIR = 'images'
 
 # Connection pool
 connection_pool = None
+pool_lock = threading.Lock()
 
-# Получаем путь к директории для изображений из .env
-IMAGES_DIR = os.getenv('IMAGES_DIR', 'images') 
+# Реплика для чтения (используется, если задан DB_REPLICA_HOST)
+DB_REPLICA_CONFIG = {}
+replica_pool = None
+replica_healthy = True
+replica_checked_at = 0.0
+replica_lock = threading.Lock()
+REPLICA_STICKY_SECONDS = 5.0
+REPLICA_MAX_LAG_SECONDS = 10.0
+REPLICA_HEALTH_INTERVAL = 15.0
 
-# Создаем директорию, если она не существует
-if not os.path.exists(IMAGES_DIR):
-    try:
-        os.makedirs(IMAGES_DIR)
-        logger.info(f"Created images directory at: {IMAGES_DIR}")
-    except Exception as e:
-        logger.error(f"Failed to create images directory: {e}")
-        raise
-else:
-    logger.info(f"Images directory exists: {IMAGES_DIR}")
+# Из какого пула взято соединение: id(conn) -> pool
+conn_pools = {}
+
+# Когда соединение primary вернулось в пул: id(conn) -> monotonic.
+# Простоявшее дольше DB_CHECKOUT_PING_SECONDS соединение проверяется перед выдачей
+conn_released_at = {}
+DB_CHECKOUT_PING_SECONDS = 30.0
+
+# Обработчики берут соединение прямо в цикле событий, и каждая пауза останавливает
+# все чаты, поэтому повтор внутри запроса один и быстрый: попытка, занявшая дольше
+# DB_RETRY_BUDGET_SECONDS (например, таймаут подключения), не повторяется, дальше
+# выручает размыкатель
+DB_RETRY_ATTEMPTS = 2
+DB_RETRY_BUDGET_SECONDS = 0.5
+
+# Ошибки, после которых имеет смысл повторить попытку на другом соединении
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Размыкатель для primary: пока база недоступна, обработчики не ждут таймаутов
+db_breaker = CircuitBreaker('postgres')
+
+class DatabaseUnavailable(Exception):
+    """The primary database is down or the circuit breaker is open"""
+
+# Сессия (обычно chat_id) текущего обработчика и время её последней записи,
+# чтобы после своих изменений сессия читала с primary
+current_session: ContextVar = ContextVar('db_session', default=None)
+session_writes = {}
+MAX_TRACKED_SESSIONS = 10000
+
+# Подписчики на изменения landmark: callback(action, landmark_id, fields)
+change_listeners = []
+
+# Состояние жизненного цикла
+env_loaded = False
+configured = False
+config_lock = threading.Lock()
+pool_ready = threading.Event()
+warmup_thread = None
+
+def load_env():
+    """Load the .env file once per process"""
+    global env_loaded
+    if env_loaded:
+        return
+    logger.info(f"Loading .env file from: {env_path}")
+    load_dotenv(env_path)
+    env_loaded = True
+
+def configure():
+    """Load and validate the database configuration once per process"""
+    global configured, IMAGES_DIR
+    with config_lock:
+        if configured:
+            return
+        load_env()
+
+        # Проверка загрузки переменных окружения
+        logger.info("Checking environment variables...")
+        for var in ['DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST', 'DB_PORT']:
+            value = os.getenv(var)
+            logger.info(f"{var}: {'Set' if value else 'Not set'}")
+
+        # Проверка наличия всех необходимых переменных окружения для БД
+        required_db_vars = ['DB_NAME', 'DB_USER', 'DB_PASSWORD']
+        missing_vars = [var for var in required_db_vars if not os.getenv(var)]
+        if missing_vars:
+            logger.error(f"Missing required database environment variables: {', '.join(missing_vars)}")
+            raise ValueError(f"Missing required database environment variables: {', '.join(missing_vars)}")
+
+        # Словарь обновляется на месте, чтобы его видели модули, импортировавшие DB_CONFIG
+        DB_CONFIG.update({
+            'dbname': os.getenv('DB_NAME'),
+            'user': os.getenv('DB_USER'),
+            'password': os.getenv('DB_PASSWORD'),
+            'host': os.getenv('DB_HOST', 'db'),  # Используем 'db' как значение по умолчанию
+            'port': os.getenv('DB_PORT', '5432'),
+            'client_encoding': 'utf8',
+            # Без таймаута подключение к перезапускающейся базе может висеть минутами
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
+        })
+
+        configure_replica()
+        configure_resilience()
+
+        IMAGES_DIR = os.getenv('IMAGES_DIR', 'images')
+
+        # Создаем директорию, если она не существует
+        if not os.path.exists(IMAGES_DIR):
+            try:
+                os.makedirs(IMAGES_DIR)
+                logger.info(f"Created images directory at: {IMAGES_DIR}")
+            except Exception as e:
+                logger.error(f"Failed to create images directory: {e}")
+                raise
+        else:
+            logger.info(f"Images directory exists: {IMAGES_DIR}")
+
+        query_stats.load_settings()
+        configured = True
+
+def configure_replica():
+    """Read the optional read-replica settings"""
+    global REPLICA_STICKY_SECONDS, REPLICA_MAX_LAG_SECONDS, REPLICA_HEALTH_INTERVAL
+    REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '10'))
+    REPLICA_HEALTH_INTERVAL = float(os.getenv('REPLICA_HEALTH_INTERVAL', '15'))
+
+    replica_host = os.getenv('DB_REPLICA_HOST')
+    if not replica_host:
+        logger.info("Read replica is not configured, all queries go to the primary")
+        return
+    DB_REPLICA_CONFIG.update(DB_CONFIG)
+    DB_REPLICA_CONFIG.update({
+        'host': replica_host,
+        'port': os.getenv('DB_REPLICA_PORT', DB_CONFIG['port']),
+        'user': os.getenv('DB_REPLICA_USER', DB_CONFIG['user']),
+        'password': os.getenv('DB_REPLICA_PASSWORD', DB_CONFIG['password']),
+    })
+    logger.info(f"Read replica configured at {replica_host}")
+
+def configure_resilience():
+    """Read retry and circuit breaker settings"""
+    global DB_CHECKOUT_PING_SECONDS, DB_RETRY_ATTEMPTS, DB_RETRY_BUDGET_SECONDS
+    DB_CHECKOUT_PING_SECONDS = float(os.getenv('DB_CHECKOUT_PING_SECONDS', '30'))
+    DB_RETRY_ATTEMPTS = int(os.getenv('DB_RETRY_ATTEMPTS', '2'))
+    DB_RETRY_BUDGET_SECONDS = float(os.getenv('DB_RETRY_BUDGET_SECONDS', '0.5'))
+    db_breaker.failure_threshold = int(os.getenv('DB_BREAKER_FAILURES', '5'))
+    db_breaker.reset_timeout = float(os.getenv('DB_BREAKER_RESET_SECONDS', '10'))
 
 def init_db_pool():
     """Initialize the database connection pool"""
     global connection_pool
-    try:
-        logger.info(f"Initializing database connection pool with config: {DB_CONFIG}")
-        connection_pool = pool.SimpleConnectionPool(
-            1,  # minconn
-            10,  # maxconn
-            **DB_CONFIG
+    configure()
+    with pool_lock:
+        if connection_pool is not None:
+            return
+        try:
+            safe_config = {k: v for k, v in DB_CONFIG.items() if k != 'password'}
+            logger.info(f"Initializing database connection pool with config: {safe_config}")
+            connection_pool = pool.ThreadedConnectionPool(
+                int(os.getenv('DB_POOL_MIN', '1')),  # minconn
+                int(os.getenv('DB_POOL_MAX', '10')),  # maxconn
+                cursor_factory=TimedCursor,  # замер времени каждого запроса
+                **DB_CONFIG
+            )
+            logger.info("Database connection pool initialized successfully")
+        except Exception as e:
+            logger.error(f"Error initializing database connection pool: {e}")
+            raise
+
+def warm_pool(prepare: Optional[Callable[[], object]] = None):
+    """Create the pool and open its minimum connections, retrying until the database is up
+
+    `prepare` (e.g. migrations) runs first with the same retries; the pool is
+    reported ready only after it has succeeded.
+    """
+    delay = 1
+    while True:
+        try:
+            if prepare is not None:
+                prepare()
+                prepare = None
+            init_db_pool()
+            conns = [connection_pool.getconn() for _ in range(connection_pool.minconn)]
+            try:
+                for conn in conns:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    conn.rollback()
+            finally:
+                for conn in conns:
+                    connection_pool.putconn(conn)
+            db_breaker.record_success()
+            pool_ready.set()
+            logger.info(f"Database pool warmed up with {len(conns)} connection(s)")
+            return
+        except Exception as e:
+            logger.warning(f"Pool warm-up failed, retrying in {delay}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+def start_pool_warmup(prepare: Optional[Callable[[], object]] = None):
+    """Warm up the pool in a background thread, after running `prepare` if given"""
+    global warmup_thread
+    if warmup_thread is not None:
+        return
+    warmup_thread = threading.Thread(target=warm_pool, args=(prepare,), name='db-pool-warmup', daemon=True)
+    warmup_thread.start()
+
+def is_ready() -> bool:
+    """Whether the pool has been created and warmed up"""
+    return pool_ready.is_set()
+
+def wait_until_ready(timeout: Optional[float] = None) -> bool:
+    """Block until the pool is warmed up, returns False on timeout"""
+    return pool_ready.wait(timeout)
+
+def init_replica_pool():
+    """Initialize the read-replica connection pool"""
+    global replica_pool
+    with pool_lock:
+        if replica_pool is not None:
+            return
+        replica_pool = pool.ThreadedConnectionPool(
+            int(os.getenv('DB_REPLICA_POOL_MIN', '1')),  # minconn
+            int(os.getenv('DB_REPLICA_POOL_MAX', '10')),  # maxconn
+            cursor_factory=TimedCursor,
+            **DB_REPLICA_CONFIG
         )
-        logger.info("Database connection pool initialized successfully")
+        logger.info("Read replica connection pool initialized successfully")
+
+def set_session(session) -> None:
+    """Bind the current handler to a session for read-your-writes routing"""
+    current_session.set(session)
+
+def mark_session_write(session=None):
+    """Remember that a session (the current one by default) has just written to the primary"""
+    if session is None:
+        session = current_session.get()
+    if session is None:
+        return
+    now = time.monotonic()
+    if len(session_writes) > MAX_TRACKED_SESSIONS:
+        for key, written_at in list(session_writes.items()):
+            if now - written_at > REPLICA_STICKY_SECONDS:
+                session_writes.pop(key, None)
+    session_writes[session] = now
+
+def session_is_sticky() -> bool:
+    """Whether the current session wrote recently and must read from the primary"""
+    session = current_session.get()
+    if session is None:
+        return False
+    written_at = session_writes.get(session)
+    return written_at is not None and time.monotonic() - written_at < REPLICA_STICKY_SECONDS
+
+def add_change_listener(callback):
+    """Subscribe to committed landmark changes ('insert', 'update', 'delete')"""
+    change_listeners.append(callback)
+
+def notify_change(action: str, landmark_id: int, fields: dict):
+    """Call change listeners after a commit, a failing listener never fails the write"""
+    for callback in change_listeners:
+        try:
+            callback(action, landmark_id, fields)
+        except Exception as e:
+            logger.error(f"Error in landmark change listener {callback!r}: {e}")
+
+def mark_replica_unhealthy(error):
+    global replica_healthy, replica_checked_at
+    if replica_healthy:
+        logger.warning(f"Read replica marked unhealthy, failing over to primary: {error}")
+    replica_healthy = False
+    replica_checked_at = time.monotonic()
+
+def check_replica_health():
+    """Probe the replica for availability and replication lag"""
+    global replica_healthy, replica_checked_at
+    conn = None
+    try:
+        if replica_pool is None:
+            init_replica_pool()
+        conn = replica_pool.getconn()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            """)
+            lag = float(cur.fetchone()[0])
+        conn.rollback()
+        if lag > REPLICA_MAX_LAG_SECONDS:
+            mark_replica_unhealthy(f"replication lag {lag:.1f}s")
+        else:
+            if not replica_healthy:
+                logger.info(f"Read replica is healthy again (lag {lag:.1f}s)")
+            replica_healthy = True
+            replica_checked_at = time.monotonic()
     except Exception as e:
-        logger.error(f"Error initializing database connection pool: {e}")
-        raise
+        mark_replica_unhealthy(e)
+    finally:
+        if conn is not None:
+            replica_pool.putconn(conn, close=conn.closed != 0)
+
+def use_replica() -> bool:
+    """Decide whether a read-only query may go to the replica"""
+    if not DB_REPLICA_CONFIG or session_is_sticky():
+        return False
+    if time.monotonic() - replica_checked_at > REPLICA_HEALTH_INTERVAL:
+        with replica_lock:
+            if time.monotonic() - replica_checked_at > REPLICA_HEALTH_INTERVAL:
+                check_replica_health()
+    return replica_healthy
+
+def ping(conn) -> bool:
+    """Whether a pooled connection is still usable"""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except TRANSIENT_ERRORS:
+        return False
 
-def get_connection():
-    """Get a connection from the pool"""
+def checkout_primary():
+    """Take a connection from the primary pool, replacing dead ones"""
     if connection_pool is None:
         init_db_pool()
-    return connection_pool.getconn()
+    # Пул может отдать несколько мёртвых соединений подряд после рестарта базы
+    for _ in range(connection_pool.maxconn + 1):
+        conn = connection_pool.getconn()
+        released_at = conn_released_at.pop(id(conn), None)
+        idle = released_at is None or time.monotonic() - released_at > DB_CHECKOUT_PING_SECONDS
+        if not conn.closed and (not idle or ping(conn)):
+            return conn
+        logger.warning("Discarding dead database connection")
+        connection_pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("No live connection in the pool")
+
+def database_available() -> bool:
+    """False while the circuit breaker fails requests fast"""
+    return not db_breaker.is_open()
+
+def get_connection(readonly: bool = False):
+    """Get a connection from the pool, read-only callers may get a replica connection
+
+    A quick transient error is retried once after a short jittered pause; a slow
+    failure is not retried. While the primary is down DatabaseUnavailable is
+    raised immediately.
+    """
+    if readonly and use_replica():
+        try:
+            conn = replica_pool.getconn()
+            conn_pools[id(conn)] = replica_pool
+            return conn
+        except Exception as e:
+            mark_replica_unhealthy(e)
+
+    last_error = None
+    started = time.monotonic()
+    for attempt, delay in enumerate(backoff_delays(DB_RETRY_ATTEMPTS), 1):
+        try:
+            db_breaker.before_call()
+        except CircuitOpenError as e:
+            raise DatabaseUnavailable(str(e)) from last_error
+        try:
+            conn = checkout_primary()
+        except TRANSIENT_ERRORS as e:
+            db_breaker.record_failure(e)
+            last_error = e
+            if time.monotonic() - started + delay > DB_RETRY_BUDGET_SECONDS:
+                break
+            if attempt < DB_RETRY_ATTEMPTS:
+                logger.warning(f"Database connection failed, retrying in {delay:.2f}s: {e}")
+                time.sleep(delay)
+            continue
+        db_breaker.record_success()
+        return conn
+    raise DatabaseUnavailable(f"Database is unavailable: {last_error}") from last_error
 
 def release_connection(conn):
-    """Release a connection back to the pool"""
-    connection_pool.putconn(conn)
+    """Release a connection back to the pool it came from"""
+    owner = conn_pools.pop(id(conn), None)
+    if owner is None:
+        if conn.closed:
+            # Соединение оборвалось во время запроса
+            db_breaker.record_failure("connection closed")
+        else:
+            conn_released_at[id(conn)] = time.monotonic()
+        connection_pool.putconn(conn, close=conn.closed != 0)
+        return
+    if conn.closed:
+        mark_replica_unhealthy("connection closed")
+    owner.putconn(conn, close=conn.closed != 0)
+
+def close_db_pool():
+    """Close all pooled connections"""
+    global connection_pool, replica_pool
+    with pool_lock:
+        if connection_pool is not None:
+            connection_pool.closeall()
+            connection_pool = None
+            pool_ready.clear()
+            logger.info("Database connection pool closed")
+        if replica_pool is not None:
+            replica_pool.closeall()
+            replica_pool = None
+            logger.info("Read replica connection pool closed")
 
-def check_landmark_exists(name: str) -> bool:
+def check_landmark_exists(name: str, readonly: bool = True) -> bool:
     """Check if a landmark with the given name exists in the landmark table"""
-    conn = get_connection()
+    conn = get_connection(readonly=readonly)
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT EXISTS(SELECT 1 FROM landmark WHERE name = %s)", (name,))
+            cur.execute("SELECT EXISTS(SELECT 1 FROM landmark WHERE name = %s AND deleted_at IS NULL)", (name,))
             exists = cur.fetchone()[0]
             logger.info(f"Checked landmark existence for name '{name}': {exists}")
             return exists
@@ -101,39 +453,31 @@ def check_landmark_exists(name: str) -> bool:
     finally:
         release_connection(conn)
 
-async def save_photo(bot: Bot, file_id: str, images_name: str) -> bool:
-    """Save photo to images directory"""
+async def save_photo(bot: Bot, file_id: str, images_name: str) -> Optional[bytes]:
+    """Save photo to the configured image storage, returns the stored bytes or None on error"""
     try:
         # Get file from Telegram
         file = await bot.get_file(file_id)
         
-        # Download file
-        file_path = os.path.join(IMAGES_DIR, images_name)
-        await file.download_to_drive(file_path)
-        logger.info(f"Saved photo to {file_path}")
-        return True
+        # Download file and store it without blocking the event loop
+        data = bytes(await file.download_as_bytearray())
+        backend = storage.get_storage()
+        await asyncio.to_thread(backend.save, images_name, data)
+        logger.info(f"Saved photo to {backend.location(images_name)}")
+        return data
     except Exception as e:
         logger.error(f"Error saving photo {images_name}: {e}")
-        return False
+        return None
 
 def sync_landmark_sequence():
     """Synchronize the landmark_id_seq with the current max ID in the landmark table"""
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            # Create sequence if it doesn't exist
+            # Последовательность создаётся миграцией 0001_initial,
+            # здесь только подтягиваем её к текущему максимальному ID
             cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (SELECT 1 FROM pg_sequences WHERE sequencename = 'landmark_id_seq') THEN
-                        CREATE SEQUENCE landmark_id_seq;
-                    END IF;
-                END $$;
-            """)
-            
-            # Get current max ID and set sequence value
-            cur.execute("""
-                SELECT setval('landmark_id_seq', COALESCE((SELECT MAX(id) FROM landmark), 0));
+                SELECT setval('landmark_id_seq', COALESCE((SELECT MAX(id) FROM landmark), 0) + 1, false);
             """)
             conn.commit()
             logger.info("Landmark sequence synchronized")
@@ -146,13 +490,13 @@ def sync_landmark_sequence():
 def save_landmark(name: str, address: str, category: str, description: str, 
                  history: str, latitude: float, longitude: float, images_name: str) -> bool:
     """Save a new landmark to the database if it doesn't exist"""
-    # First check if landmark exists
-    if check_landmark_exists(name):
+    # First check if landmark exists (на primary, чтобы не пропустить дубликат из-за задержки реплики)
+    if check_landmark_exists(name, readonly=False):
         logger.warning(f"Landmark with name '{name}' already exists")
         return False
 
-    # Sync sequence before inserting
-    sync_landmark_sequence()
+    # id выдаёт landmark_id_seq (DEFAULT из миграции 0001); синхронизация последовательности
+    # перед вставкой ломала параллельные вставки нескольких воркеров
 
     conn = get_connection()
     try:
@@ -166,6 +510,8 @@ def save_landmark(name: str, address: str, category: str, description: str,
             
             landmark_id = cur.fetchone()[0]
             conn.commit()
+            mark_session_write()
+            notify_change('insert', landmark_id, {'name': name, 'category': category, 'images_name': images_name})
             logger.info(f"Saved new landmark ID {landmark_id}: {name}")
             return True
     except Exception as e:
@@ -175,19 +521,18 @@ def save_landmark(name: str, address: str, category: str, description: str,
     finally:
         release_connection(conn)
 
-def get_all_landmarks() -> List[Tuple]:
-    conn = get_connection()
+def get_all_landmarks(columns: Sequence[str] = models.LIST_COLUMNS) -> List[models.Landmark]:
+    """Get all live landmarks with only the requested columns"""
+    conn = get_connection(readonly=True)
     try:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT id, name, address, category, description, history,
-                       ST_X(location::geometry) as longitude,
-                       ST_Y(location::geometry) as latitude,
-                       images_name
+            cur.execute(f"""
+                SELECT {models.select_list(columns)}
                 FROM landmark
+                WHERE deleted_at IS NULL
                 ORDER BY id
             """)
-            landmarks = cur.fetchall()
+            landmarks = [models.Landmark.from_row(columns, row) for row in cur.fetchall()]
             logger.info(f"Retrieved {len(landmarks)} landmarks")
             return landmarks
     except Exception as e:
@@ -196,32 +541,92 @@ def get_all_landmarks() -> List[Tuple]:
     finally:
         release_connection(conn)
 
-def get_landmark_by_id(landmark_id: int) -> Optional[dict]:
-    conn = get_connection()
+def get_landmark_names() -> List[Tuple[int, str]]:
+    """Get (id, name) of all live landmarks"""
+    conn = get_connection(readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, name FROM landmark WHERE deleted_at IS NULL")
+            names = cur.fetchall()
+            logger.info(f"Retrieved {len(names)} landmark names")
+            return names
+    except Exception as e:
+        logger.error(f"Error retrieving landmark names: {e}")
+        raise
+    finally:
+        release_connection(conn)
+
+def get_landmarks_by_category(category: str, columns: Sequence[str] = models.LIST_COLUMNS) -> List[models.Landmark]:
+    """Get landmarks of a single category with only the requested columns"""
+    conn = get_connection(readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {models.select_list(columns)}
+                FROM landmark
+                WHERE category = %s AND deleted_at IS NULL
+                ORDER BY id
+            """, (category,))
+            landmarks = [models.Landmark.from_row(columns, row) for row in cur.fetchall()]
+            logger.info(f"Retrieved {len(landmarks)} landmarks in category '{category}'")
+            return landmarks
+    except Exception as e:
+        logger.error(f"Error retrieving landmarks in category '{category}': {e}")
+        raise
+    finally:
+        release_connection(conn)
+
+def get_landmark_texts(landmark_ids: List[int]) -> Dict[int, Tuple[str, str]]:
+    """Get (description, history) for the given ids, used by lazy Landmark fields"""
+    conn = get_connection(readonly=True)
     try:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT id, name, address, category, description, history,
-                       ST_X(location::geometry) as longitude,
-                       ST_Y(location::geometry) as latitude,
-                       images_name
+                SELECT id, description, history
                 FROM landmark
-                WHERE id = %s
+                WHERE id = ANY(%s)
+            """, (landmark_ids,))
+            return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+    except Exception as e:
+        logger.error(f"Error retrieving texts for {len(landmark_ids)} landmark(s): {e}")
+        raise
+    finally:
+        release_connection(conn)
+
+def get_landmark_stats() -> List[Tuple[str, str, int]]:
+    """Get (category, region, count) counters maintained by the landmark_stats triggers"""
+    conn = get_connection(readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT category, region, landmark_count
+                FROM landmark_stats
+                WHERE landmark_count > 0
+                ORDER BY category, region
+            """)
+            stats = cur.fetchall()
+            logger.info(f"Retrieved {len(stats)} landmark stats rows")
+            return stats
+    except Exception as e:
+        logger.error(f"Error retrieving landmark stats: {e}")
+        raise
+    finally:
+        release_connection(conn)
+
+def get_landmark_by_id(landmark_id: int, columns: Sequence[str] = models.CARD_COLUMNS) -> Optional[models.Landmark]:
+    """Get a landmark card; description and history are loaded on first access unless selected"""
+    conn = get_connection(readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {models.select_list(columns)}
+                FROM landmark
+                WHERE id = %s AND deleted_at IS NULL
             """, (landmark_id,))
             row = cur.fetchone()
             if row:
-                landmark = {
-                    'id': row[0],
-                    'name': row[1],
-                    'address': row[2],
-                    'category': row[3],
-                    'description': row[4],
-                    'history': row[5],
-                    'longitude': row[6],
-                    'latitude': row[7],
-                    'images_name': row[8],
-                }
-                logger.info(f"Retrieved landmark ID {landmark_id}: {landmark['name']}")
+                landmark = models.Landmark.from_row(columns, row)
+                logger.info(f"Retrieved landmark ID {landmark_id}")
                 return landmark
             logger.warning(f"Landmark ID {landmark_id} not found")
             return None
@@ -232,12 +637,20 @@ def get_landmark_by_id(landmark_id: int) -> Optional[dict]:
         release_connection(conn)
 
 def delete_landmark_by_id(landmark_id: int) -> bool:
+    """Soft-delete a landmark, the row stays as a tombstone for the change feed"""
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM landmark WHERE id = %s", (landmark_id,))
+            cur.execute("""
+                UPDATE landmark
+                SET deleted_at = now()
+                WHERE id = %s AND deleted_at IS NULL
+            """, (landmark_id,))
             conn.commit()
+            mark_session_write()
             deleted = cur.rowcount > 0
+            if deleted:
+                notify_change('delete', landmark_id, {})
             logger.info(f"Landmark ID {landmark_id} deletion: {'successful' if deleted else 'not found'}")
             return deleted
     except Exception as e:
@@ -257,20 +670,23 @@ def update_landmark_field(landmark_id: int, field: str, value: any) -> bool:
                 cur.execute("""
                     UPDATE landmark 
                     SET location = ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
-                    WHERE id = %s
+                    WHERE id = %s AND deleted_at IS NULL
                 """, (longitude, latitude, landmark_id))
-            elif field == "name" and check_landmark_exists(value):
+            elif field == "name" and check_landmark_exists(value, readonly=False):
                 logger.warning(f"Landmark with name '{value}' already exists")
                 return False
             else:
                 cur.execute(f"""
                     UPDATE landmark 
                     SET {field} = %s
-                    WHERE id = %s
+                    WHERE id = %s AND deleted_at IS NULL
                 """, (value, landmark_id))
             
             conn.commit()
+            mark_session_write()
             updated = cur.rowcount > 0
+            if updated:
+                notify_change('update', landmark_id, {field: value})
             logger.info(f"Updated field {field} for landmark ID {landmark_id}: {'successful' if updated else 'not found'}")
             return updated
     except Exception as e:
@@ -288,7 +704,7 @@ async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         text = "Список достопримечательностей:\n"
         for lm in landmarks:
-            text += f"ID: {lm[0]}, Название: {lm[1]}, Адрес: {lm[2]}, Категория: {lm[3]}\n"
+            text += f"ID: {lm.id}, Название: {lm.name}, Адрес: {lm.address}, Категория: {lm.category}\n"
         await update.message.reply_text(text)
         logger.info(f"Listed landmarks for chat_id {update.effective_chat.id}")
     except Exception as e:
@@ -312,36 +728,20 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in delete_command: {e}")
         await update.message.reply_text("Ошибка при удалении достопримечательности.")
 
-def get_landmark_by_name(name: str) -> Optional[dict]:
+def get_landmark_by_name(name: str, columns: Sequence[str] = models.CARD_COLUMNS) -> Optional[models.Landmark]:
     """Get landmark details by name"""
-    conn = get_connection()
+    conn = get_connection(readonly=True)
     try:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT l.*, 
-                       ST_X(l.location::geometry) as longitude,
-                       ST_Y(l.location::geometry) as latitude,
-                       c.category_name
-                FROM landmark l
-                LEFT JOIN category c ON l.id = c.landmark_id
-                WHERE l.name = %s
+            cur.execute(f"""
+                SELECT {models.select_list(columns)}
+                FROM landmark
+                WHERE name = %s AND deleted_at IS NULL
             """, (name,))
-            result = cur.fetchone()
-            if result:
-                landmark = {
-                    'id': result[0],
-                    'name': result[1],
-                    'address': result[2],
-                    'category': result[3],
-                    'description': result[4],
-                    'history': result[5],
-                    'photo': result[6],
-                    'location': result[7],  # This is the geography point
-                    'latitude': result[8],  # Extracted from location
-                    'longitude': result[9],  # Extracted from location
-                    'category_name': result[10]
-                }
-                logger.info(f"Retrieved landmark by name '{name}': ID {landmark['id']}")
+            row = cur.fetchone()
+            if row:
+                landmark = models.Landmark.from_row(columns, row)
+                logger.info(f"Retrieved landmark by name '{name}'")
                 return landmark
             logger.warning(f"Landmark with name '{name}' not found")
             return None
@@ -349,4 +749,4 @@ def get_landmark_by_name(name: str) -> Optional[dict]:
         logger.error(f"Error retrieving landmark by name '{name}': {e}")
         raise
     finally:
-        release_connection(conn)
\ No newline at end of file
+        release_connection(conn)
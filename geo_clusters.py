@@ -0,0 +1,219 @@
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import List, Tuple
+
+from db_config import configure, get_connection, release_connection
+
+logger = logging.getLogger(__name__)
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Точности geohash, которые поддерживает таблица landmark_cluster (миграция 0007)
+MIN_PRECISION = 1
+MAX_PRECISION = 7
+
+# Максимум ячеек на один запрос: при большем числе точность понижается
+MAX_CELLS = 512
+
+# Кэш ответов: (precision, ячейки) -> (истекает, кластеры)
+cluster_cache = {}
+cache_lock = threading.Lock()
+MAX_CACHE_ENTRIES = 1024
+
+def zoom_to_precision(zoom: int) -> int:
+    """Map a web map zoom level (0-20) to a geohash precision"""
+    return max(MIN_PRECISION, min(MAX_PRECISION, zoom // 3 + 1))
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    """Encode a point as a geohash string"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = bits * 2 + 1
+                lon_range[0] = mid
+            else:
+                bits = bits * 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = bits * 2 + 1
+                lat_range[0] = mid
+            else:
+                bits = bits * 2
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Return (lat_step, lon_step) of a geohash cell in degrees"""
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+def cells_in_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int) -> List[str]:
+    """List geohash cells of the given precision that intersect the bounding box"""
+    lat_step, lon_step = cell_size(precision)
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+    lat_start = -90.0 + math.floor((min_lat + 90.0) / lat_step) * lat_step
+    lon_start = -180.0 + math.floor((min_lon + 180.0) / lon_step) * lon_step
+
+    cells = []
+    lat = lat_start
+    while lat <= max_lat and lat < 90.0:
+        lon = lon_start
+        while lon <= max_lon and lon < 180.0:
+            # Кодируем центр ячейки, чтобы не попасть на границу соседней
+            cells.append(geohash_encode(lat + lat_step / 2, lon + lon_step / 2, precision))
+            lon += lon_step
+        lat += lat_step
+    return cells
+
+def count_cells(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int) -> int:
+    lat_step, lon_step = cell_size(precision)
+    rows = math.floor((min(max_lat, 90.0) + 90.0) / lat_step) - math.floor((max(min_lat, -90.0) + 90.0) / lat_step) + 1
+    cols = math.floor((min(max_lon, 180.0) + 180.0) / lon_step) - math.floor((max(min_lon, -180.0) + 180.0) / lon_step) + 1
+    return rows * cols
+
+def fetch_clusters(precision: int, cells: List[str]) -> List[dict]:
+    """Read precomputed clusters for the given cells"""
+    conn = get_connection(readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT geohash, landmark_count, sum_lat, sum_lon
+                FROM landmark_cluster
+                WHERE precision = %s AND geohash = ANY(%s) AND landmark_count > 0
+            """, (precision, cells))
+            rows = cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error retrieving clusters at precision {precision}: {e}")
+        raise
+    finally:
+        release_connection(conn)
+
+    return [
+        {
+            'geohash': geohash,
+            'count': count,
+            'lat': sum_lat / count,
+            'lon': sum_lon / count,
+        }
+        for geohash, count, sum_lat, sum_lon in rows
+    ]
+
+def get_clusters(min_lat: float, min_lon: float, max_lat: float, max_lon: float, zoom: int) -> dict:
+    """Return landmark clusters for a bounding box at a map zoom level
+
+    The work depends only on the number of cells in the box (at most MAX_CELLS),
+    not on the number of landmarks.
+    """
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError("Bounding box must be given as min_lat, min_lon, max_lat, max_lon")
+
+    precision = zoom_to_precision(zoom)
+    while precision > MIN_PRECISION and count_cells(min_lat, min_lon, max_lat, max_lon, precision) > MAX_CELLS:
+        precision -= 1
+    cells = tuple(sorted(set(cells_in_bbox(min_lat, min_lon, max_lat, max_lon, precision))))
+
+    ttl = float(os.getenv('CLUSTER_CACHE_SECONDS', '30'))
+    key = (precision, cells)
+    now = time.monotonic()
+    with cache_lock:
+        cached = cluster_cache.get(key)
+    if cached is not None and cached[0] > now:
+        clusters = cached[1]
+    else:
+        clusters = fetch_clusters(precision, list(cells))
+        with cache_lock:
+            if len(cluster_cache) >= MAX_CACHE_ENTRIES:
+                cluster_cache.clear()
+            cluster_cache[key] = (now + ttl, clusters)
+
+    return {
+        'zoom': zoom,
+        'precision': precision,
+        'bbox': [min_lat, min_lon, max_lat, max_lon],
+        'clusters': clusters,
+    }
+
+def export_tiles(out_dir: str) -> int:
+    """Write precomputed tiles as out_dir/<precision>/<parent geohash>.json
+
+    A tile holds all clusters of one precision inside a parent cell one
+    character shorter; precision 1 goes to out_dir/1/world.json.
+    """
+    written = 0
+    for precision in range(MIN_PRECISION, MAX_PRECISION + 1):
+        conn = get_connection(readonly=True)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT geohash, landmark_count, sum_lat, sum_lon
+                    FROM landmark_cluster
+                    WHERE precision = %s AND landmark_count > 0
+                    ORDER BY geohash
+                """, (precision,))
+                rows = cur.fetchall()
+        finally:
+            release_connection(conn)
+
+        tiles = {}
+        for geohash, count, sum_lat, sum_lon in rows:
+            parent = geohash[:-1] or 'world'
+            tiles.setdefault(parent, []).append({
+                'geohash': geohash,
+                'count': count,
+                'lat': sum_lat / count,
+                'lon': sum_lon / count,
+            })
+
+        tile_dir = os.path.join(out_dir, str(precision))
+        os.makedirs(tile_dir, exist_ok=True)
+        for parent, clusters in tiles.items():
+            tmp_path = os.path.join(tile_dir, f".{parent}.json.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'precision': precision, 'parent': parent, 'clusters': clusters}, f)
+            os.replace(tmp_path, os.path.join(tile_dir, f"{parent}.json"))
+            written += 1
+    logger.info(f"Exported {written} cluster tiles to {out_dir}")
+    return written
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Кластеры достопримечательностей для карты")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bbox_parser = subparsers.add_parser('bbox', help="кластеры в прямоугольнике в формате JSON")
+    bbox_parser.add_argument('min_lat', type=float)
+    bbox_parser.add_argument('min_lon', type=float)
+    bbox_parser.add_argument('max_lat', type=float)
+    bbox_parser.add_argument('max_lon', type=float)
+    bbox_parser.add_argument('zoom', type=int)
+    export_parser = subparsers.add_parser('export', help="выгрузить все тайлы в каталог")
+    export_parser.add_argument('out_dir')
+    args = parser.parse_args()
+
+    configure()
+    if args.command == 'bbox':
+        print(json.dumps(get_clusters(args.min_lat, args.min_lon, args.max_lat, args.max_lon, args.zoom)))
+    elif args.command == 'export':
+        export_tiles(args.out_dir)
@@ -0,0 +1,213 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import db_config
+from changes import batch_size, changes_since
+from storage import StorageBackend, get_storage
+
+logger = logging.getLogger(__name__)
+
+# Файлы моложе этого возраста не считаются сиротами: save_photo сохраняет файл
+# раньше, чем строка попадает в landmark и в ленту изменений
+DEFAULT_GRACE_SECONDS = 3600
+
+# Сколько имён показывать в отчёте
+REPORT_LIMIT = 20
+
+# Сигнатуры поддерживаемых форматов для проверки целостности
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',  # JPEG
+    b'\x89PNG\r\n\x1a\n',  # PNG
+    b'GIF87a', b'GIF89a',
+    b'RIFF',  # WEBP
+)
+
+gc_thread = None
+gc_lock = threading.Lock()
+
+def default_state_path() -> str:
+    db_config.configure()
+    return os.getenv('IMAGE_GC_STATE_PATH', os.path.join(db_config.IMAGES_DIR, '.gc', 'state.json'))
+
+def load_state(path: str) -> dict:
+    """Load the persisted index, an absent or broken file means a full rescan"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {'cursor': '', 'refs': {}, 'files': {}}
+    except Exception as e:
+        logger.warning(f"Image GC state at {path} is unreadable, starting from scratch: {e}")
+        return {'cursor': '', 'refs': {}, 'files': {}}
+    state.setdefault('cursor', '')
+    state.setdefault('refs', {})
+    state.setdefault('files', {})
+    return state
+
+def save_state(path: str, state: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def sync_references(state: dict) -> int:
+    """Apply landmark changes since the last run to the landmark_id -> images_name map"""
+    refs = state['refs']
+    batch = batch_size()
+    applied = 0
+    while True:
+        changes, cursor = changes_since(state['cursor'], batch)
+        for change in changes:
+            key = str(change['id'])
+            if change['deleted'] or not change.get('images_name'):
+                refs.pop(key, None)
+            else:
+                refs[key] = change['images_name']
+        applied += len(changes)
+        state['cursor'] = cursor or ''
+        # Неполная пачка означает конец ленты
+        if len(changes) < batch:
+            return applied
+
+def live_references(names) -> set:
+    """Names among `names` that live landmarks reference right now"""
+    conn = db_config.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT images_name
+                FROM landmark
+                WHERE images_name = ANY(%s) AND deleted_at IS NULL
+            """, (list(names),))
+            rows = cur.fetchall()
+        conn.rollback()
+    finally:
+        db_config.release_connection(conn)
+    return {row[0] for row in rows}
+
+def is_valid_image(backend: StorageBackend, name: str) -> bool:
+    """Cheap integrity check: the file is not empty and starts with a known image signature"""
+    try:
+        head = backend.read_head(name, 16)
+    except FileNotFoundError:
+        return False
+    return any(head.startswith(signature) for signature in IMAGE_SIGNATURES)
+
+def scan_files(backend: StorageBackend, state: dict) -> dict:
+    """Refresh the size/mtime index, verifying only new or modified files"""
+    previous = state['files']
+    current = {}
+    stats = {'new': 0, 'changed': 0, 'removed': 0}
+    for stored in backend.iter_files():
+        known = previous.get(stored.name)
+        if known is not None and known[0] == stored.size and known[1] == stored.mtime:
+            current[stored.name] = known
+            continue
+        stats['new' if known is None else 'changed'] += 1
+        current[stored.name] = [stored.size, stored.mtime, is_valid_image(backend, stored.name)]
+    stats['removed'] = len(set(previous) - set(current))
+    state['files'] = current
+    return stats
+
+def run_gc(delete: bool = False, state_path: Optional[str] = None, grace_seconds: Optional[float] = None) -> dict:
+    """Reconcile images_name references with stored files and report (or delete) orphans"""
+    with gc_lock:
+        if state_path is None:
+            state_path = default_state_path()
+        if grace_seconds is None:
+            grace_seconds = float(os.getenv('IMAGE_GC_GRACE_SECONDS', DEFAULT_GRACE_SECONDS))
+        backend = get_storage()
+        started = time.monotonic()
+
+        state = load_state(state_path)
+        ref_changes = sync_references(state)
+        file_stats = scan_files(backend, state)
+
+        referenced = set(state['refs'].values())
+        files = state['files']
+        now = time.time()
+        orphans = sorted(
+            name for name, info in files.items()
+            if name not in referenced and now - info[1] > grace_seconds
+        )
+        missing = sorted(name for name in referenced if name not in files)
+        corrupt = sorted(name for name in referenced if name in files and not files[name][2])
+
+        deleted = 0
+        if delete and orphans:
+            # Перед удалением сверяемся с самой таблицей: лента изменений отдаёт строку
+            # только после завершения её транзакции и может отставать
+            still_used = live_references(orphans)
+            if still_used:
+                logger.warning(f"Not deleting {len(still_used)} image(s) still referenced by landmarks")
+                orphans = [name for name in orphans if name not in still_used]
+            for name in orphans:
+                try:
+                    backend.delete(name)
+                    files.pop(name, None)
+                    deleted += 1
+                except Exception as e:
+                    logger.error(f"Failed to delete orphan image {name}: {e}")
+
+        save_state(state_path, state)
+
+        report = {
+            'reference_changes': ref_changes,
+            'files': len(files),
+            'orphans': orphans,
+            'missing': missing,
+            'corrupt': corrupt,
+            'deleted': deleted,
+            **file_stats,
+        }
+        logger.info(
+            f"Image GC finished in {time.monotonic() - started:.1f}s: {len(files)} files, "
+            f"{file_stats['new']} new, {file_stats['changed']} changed, {file_stats['removed']} removed, "
+            f"{len(orphans)} orphans ({deleted} deleted), {len(missing)} missing, {len(corrupt)} corrupt"
+        )
+        if orphans and not delete:
+            logger.info(f"Orphan images: {', '.join(orphans[:REPORT_LIMIT])}")
+        if missing:
+            logger.warning(f"Images referenced by landmarks but missing: {', '.join(missing[:REPORT_LIMIT])}")
+        if corrupt:
+            logger.warning(f"Images that do not look like valid images: {', '.join(corrupt[:REPORT_LIMIT])}")
+        return report
+
+def _gc_loop(interval: int, delete: bool):
+    while True:
+        time.sleep(interval)
+        try:
+            run_gc(delete=delete)
+        except Exception as e:
+            logger.error(f"Error in image GC: {e}")
+
+def start_gc_thread():
+    """Start the background reconciler (IMAGE_GC_INTERVAL seconds, 0 disables it)"""
+    global gc_thread
+    interval = int(os.getenv('IMAGE_GC_INTERVAL', '3600'))
+    if gc_thread is not None or interval <= 0:
+        return
+    delete = os.getenv('IMAGE_GC_DELETE', '0') == '1'
+    gc_thread = threading.Thread(target=_gc_loop, args=(interval, delete), name='image-gc', daemon=True)
+    gc_thread.start()
+    logger.info(f"Image GC thread started, interval {interval}s, {'deleting' if delete else 'reporting'} orphans")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Поиск файлов-сирот и отсутствующих изображений")
+    parser.add_argument('--delete', action='store_true', help="удалить файлы-сироты")
+    parser.add_argument('--full', action='store_true', help="сбросить сохранённый индекс и проверить всё заново")
+    parser.add_argument('--grace', type=float, default=None, help="минимальный возраст сироты в секундах")
+    args = parser.parse_args()
+
+    path = default_state_path()
+    if args.full and os.path.exists(path):
+        os.remove(path)
+    result = run_gc(delete=args.delete, state_path=path, grace_seconds=args.grace)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
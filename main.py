@@ -1,19 +1,31 @@
+import argparse
+import html
 import logging
 import os
 import sys
 from datetime import datetime
-from telegram import Update, InputMediaPhoto, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Bot, Update, InputMediaPhoto, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import (
     Application,
     CommandHandler,
+    ApplicationHandlerStop,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes,
     ConversationHandler
 )
 from telegram.error import NetworkError, TimedOut, TelegramError
-from db_config import init_db_pool, check_landmark_exists, save_landmark, save_photo, get_all_landmarks, delete_landmark_by_id, get_landmark_by_id, update_landmark_field
-from dotenv import load_dotenv
+from db_config import load_env, configure, close_db_pool, start_pool_warmup, wait_until_ready, set_session, database_available, DatabaseUnavailable, check_landmark_exists, save_photo, get_all_landmarks, get_landmarks_by_category, get_landmark_stats, get_landmark_by_id
+from query_stats import start_report_thread
+from migrate import run_migrations
+from models import FULL_COLUMNS
+from image_gc import start_gc_thread
+from name_index import name_index, start_name_index, start_notify_listener
+from photo_hash import find_duplicates, index_photo, start_photo_index
+from workers import PostgresPersistence, claim_polling, claim_shard, run_poller, run_single, run_worker
+import write_behind
 import asyncio
 import traceback
 import httpx
@@ -30,8 +42,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения из .env файла
-load_dotenv()
+# Загрузка переменных окружения из .env файла (один раз на процесс)
+load_env()
 
 # Конфигурация из переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -39,10 +51,22 @@ ADMIN_LOGIN = os.getenv('ADMIN_LOGIN')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 PROXY_URL = os.getenv('PROXY_URL')
 
-# Проверка наличия необходимых переменных окружения
-if not all([BOT_TOKEN, ADMIN_LOGIN, ADMIN_PASSWORD]):
-    logger.error("Missing required environment variables. Please check your .env file.")
-    raise ValueError("Missing required environment variables. Please check your .env file.")
+MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', '1') == '1'
+
+# Время кэширования inline-ответов на стороне Telegram, секунды
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '30'))
+
+# Файл-признак готовности для healthcheck контейнера
+READY_FILE = os.getenv('READY_FILE', '/tmp/bot.ready')
+
+# Как часто сохранять chat_data и состояния диалогов в базу, секунды
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '10'))
+
+def check_config():
+    """Validate the bot configuration"""
+    if not all([BOT_TOKEN, ADMIN_LOGIN, ADMIN_PASSWORD]):
+        logger.error("Missing required environment variables. Please check your .env file.")
+        raise ValueError("Missing required environment variables. Please check your .env file.")
 
 # Состояния диалога
 (
@@ -53,9 +77,19 @@ if not all([BOT_TOKEN, ADMIN_LOGIN, ADMIN_PASSWORD]):
     EDIT_FIELD, EDIT_VALUE
 ) = range(12)
 
-# Хранилища данных
-authorized_users = set()
-temp_data = {}
+# Состояние диалога хранится в context.chat_data: "authorized" - признак входа,
+# "draft" - данные добавляемой или редактируемой достопримечательности.
+# При PostgresPersistence оно сохраняется в базе (см. workers.py)
+
+MAINTENANCE_MESSAGE = "🛠 База данных временно недоступна, идут технические работы. Попробуйте через минуту."
+
+# Для поиска дубликатов хватает уменьшенной копии фото: dHash не зависит от размера
+DUPLICATE_CHECK_MIN_WIDTH = 256
+
+# Готовые inline-ответы: префикс -> результаты, сбрасывается при изменении индекса
+inline_results_cache = {}
+inline_cache_version = None
+MAX_INLINE_CACHE_ENTRIES = 5000
 
 # Клавиатура для продолжения
 continue_keyboard = ReplyKeyboardMarkup(
@@ -64,17 +98,20 @@ continue_keyboard = ReplyKeyboardMarkup(
     one_time_keyboard=True
 )
 
-# Категории для клавиатуры
+# Категории достопримечательностей
+CATEGORIES = [
+    "Замки", "Религия",
+    "Музей", "Архитектура",
+    "Памятник", "Парк",
+    "Природа", "Театр",
+    "Концертный зал", "Необычное",
+    "Археология", "Арт-объект",
+    "Фонтан", "Наука"
+]
+
+# Категории для клавиатуры (по две в ряд)
 categories_keyboard = ReplyKeyboardMarkup(
-    [
-        ["Замки", "Религия"],
-        ["Музей", "Архитектура"],
-        ["Памятник", "Парк"],
-        ["Природа", "Театр"],
-        ["Концертный зал", "Необычное"],
-        ["Археология", "Арт-объект"],
-        ["Фонтан", "Наука"]
-    ],
+    [CATEGORIES[i:i + 2] for i in range(0, len(CATEGORIES), 2)],
     resize_keyboard=True,
     one_time_keyboard=True
 )
@@ -95,7 +132,13 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     """Handle errors in the telegram bot."""
     logger.error("Exception while handling an update:", exc_info=context.error)
 
-    if isinstance(context.error, NetworkError):
+    # Обработчики пропускают DatabaseUnavailable сюда, чтобы пользователь получил
+    # сообщение о технических работах, а не общее "Произошла ошибка"
+    if isinstance(context.error, DatabaseUnavailable):
+        logger.error("Database is unavailable")
+        if isinstance(update, Update) and update.effective_message:
+            await update.effective_message.reply_text(MAINTENANCE_MESSAGE)
+    elif isinstance(context.error, NetworkError):
         logger.error("Network error occurred. Will retry automatically.")
     elif isinstance(context.error, TimedOut):
         logger.error("Request timed out. Will retry automatically.")
@@ -103,11 +146,26 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error(f"Update {update} caused error {context.error}")
         logger.error(traceback.format_exc())
 
+async def bind_db_session(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Route reads of this update by chat so that a chat always sees its own writes"""
+    if update.effective_chat:
+        set_session(update.effective_chat.id)
+    elif update.effective_user:
+        set_session(update.effective_user.id)
+
+async def database_guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer with a maintenance message instead of running handlers while the database is down"""
+    # Inline-подсказки обслуживаются из памяти и работают без базы
+    if update.inline_query or database_available():
+        return
+    if update.effective_message:
+        await update.effective_message.reply_text(MAINTENANCE_MESSAGE)
+    raise ApplicationHandlerStop
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
 
-        if is_authorized(chat_id):
+        if is_authorized(context):
             await update.message.reply_text(
                 "🔓 Вы уже авторизованы!\n\n"
                 "Введите название достопримечательности:",
@@ -121,6 +179,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             reply_markup=ReplyKeyboardRemove()
         )
         return LOGIN
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in start handler: {e}")
         await update.message.reply_text(
@@ -132,12 +192,14 @@ async def login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         user_input = update.message.text
         if user_input == ADMIN_LOGIN:
-            temp_data[update.effective_chat.id] = {}
+            context.chat_data["draft"] = {}
             await update.message.reply_text("✅ Логин верный. Теперь введите пароль:")
             return PASSWORD
         else:
             await update.message.reply_text("❌ Неверный логин. Попробуйте снова:")
             return LOGIN
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in login handler: {e}")
         await update.message.reply_text(
@@ -147,11 +209,10 @@ async def login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
         user_input = update.message.text
 
         if user_input == ADMIN_PASSWORD:
-            authorized_users.add(chat_id)
+            context.chat_data["authorized"] = True
             await update.message.reply_text(
                 "🔓 Авторизация успешна!\n\n"
                 "Введите название достопримечательности:",
@@ -161,6 +222,8 @@ async def password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         else:
             await update.message.reply_text("❌ Неверный пароль. Попробуйте снова:")
             return PASSWORD
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in password handler: {e}")
         await update.message.reply_text(
@@ -170,7 +233,6 @@ async def password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
         name = update.message.text
 
         if check_landmark_exists(name):
@@ -180,9 +242,11 @@ async def name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return ConversationHandler.END
 
-        temp_data[chat_id] = {"name": name}
+        context.chat_data["draft"] = {"name": name}
         await update.message.reply_text("🏠 Введите адрес достопримечательности:")
         return ADDRESS
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in name handler: {e}")
         await update.message.reply_text(
@@ -192,13 +256,14 @@ async def name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def address(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
-        temp_data[chat_id]["address"] = update.message.text
+        context.chat_data["draft"]["address"] = update.message.text
         await update.message.reply_text(
             "📌 Выберите категорию достопримечательности:",
             reply_markup=categories_keyboard
         )
         return CATEGORY
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in address handler: {e}")
         await update.message.reply_text(
@@ -208,13 +273,14 @@ async def address(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
-        temp_data[chat_id]["category"] = update.message.text
+        context.chat_data["draft"]["category"] = update.message.text
         await update.message.reply_text(
             "📝 Введите описание достопримечательности:",
             reply_markup=ReplyKeyboardRemove()
         )
         return DESCRIPTION
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in category handler: {e}")
         await update.message.reply_text(
@@ -224,10 +290,11 @@ async def category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
-        temp_data[chat_id]["description"] = update.message.text
+        context.chat_data["draft"]["description"] = update.message.text
         await update.message.reply_text("📜 Введите историческую справку:")
         return HISTORY
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in description handler: {e}")
         await update.message.reply_text(
@@ -237,8 +304,7 @@ async def description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
-        temp_data[chat_id]["history"] = update.message.text
+        context.chat_data["draft"]["history"] = update.message.text
         await update.message.reply_text(
             "📍 Введите координаты достопримечательности в формате:\n"
             "<i>широта, долгота</i>\n\n"
@@ -246,6 +312,8 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             parse_mode="HTML"
         )
         return LOCATION
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in history handler: {e}")
         await update.message.reply_text(
@@ -255,7 +323,6 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
         user_input = update.message.text
 
         try:
@@ -266,7 +333,7 @@ async def location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
                 raise ValueError("Неверный диапазон координат")
 
-            temp_data[chat_id]["location"] = (lat, lon)
+            context.chat_data["draft"]["location"] = (lat, lon)
             await update.message.reply_text(
                 "📸 Отправьте фотографию достопримечательности:"
             )
@@ -280,6 +347,8 @@ async def location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 parse_mode="HTML"
             )
             return LOCATION
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in location handler: {e}")
         await update.message.reply_text(
@@ -289,7 +358,6 @@ async def location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def photos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
         photos = update.message.photo
 
         if not photos:
@@ -298,12 +366,16 @@ async def photos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
         # Get the highest quality photo
         photo = max(photos, key=lambda x: x.file_size)
-        temp_data[chat_id]["photo"] = photo.file_id
+        context.chat_data["draft"]["photo"] = photo.file_id
+
+        await warn_about_duplicates(update, context, photos)
 
         await update.message.reply_text(
             "📝 Введите имя файла для сохранения фотографии (например: landmark_photo.jpg):"
         )
         return IMAGE_NAME
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in photos handler: {e}")
         await update.message.reply_text(
@@ -317,7 +389,7 @@ async def image_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         images_name = update.message.text
 
         # Получаем все собранные данные
-        data = temp_data[chat_id]
+        data = context.chat_data["draft"]
         name = data["name"]
         address = data["address"]
         category = data["category"]
@@ -327,15 +399,18 @@ async def image_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         photo_file_id = data["photo"]
 
         # Сохраняем фотографию
-        if not await save_photo(context.bot, photo_file_id, images_name):
+        photo = await save_photo(context.bot, photo_file_id, images_name)
+        if photo is None:
             await update.message.reply_text(
                 "❌ Ошибка при сохранении фотографии. Попробуйте позже.",
                 reply_markup=continue_keyboard
             )
             return ConversationHandler.END
+        # Хэш для поиска дубликатов считается в фоне по уже скачанным байтам
+        context.application.create_task(asyncio.to_thread(index_photo, images_name, photo))
 
         # Сохраняем в базу данных
-        success = save_landmark(
+        success = await write_behind.save_landmark(
             name=name,
             address=address,
             category=category,
@@ -370,10 +445,11 @@ async def image_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             reply_markup=continue_keyboard
         )
 
-        if chat_id in temp_data:
-            del temp_data[chat_id]
+        context.chat_data.pop("draft", None)
 
         return ConversationHandler.END
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in image_name handler: {e}")
         await update.message.reply_text(
@@ -381,10 +457,34 @@ async def image_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         return ConversationHandler.END
 
+async def warn_about_duplicates(update: Update, context: ContextTypes.DEFAULT_TYPE, photos) -> None:
+    """Warn if the photo looks like the photo of an existing landmark"""
+    try:
+        preview = min(
+            (size for size in photos if size.width >= DUPLICATE_CHECK_MIN_WIDTH),
+            key=lambda size: size.width,
+            default=photos[-1]
+        )
+        file = await context.bot.get_file(preview.file_id)
+        data = bytes(await file.download_as_bytearray())
+        duplicates = await asyncio.to_thread(find_duplicates, data)
+    except Exception as e:
+        # Проверка необязательна и не должна прерывать добавление
+        logger.error(f"Error checking photo for duplicates: {e}")
+        return
+
+    if duplicates:
+        lines = "\n".join(f"ID {duplicate['id']}: {duplicate['name']}" for duplicate in duplicates[:5])
+        await update.message.reply_text(
+            "⚠️ Похожая фотография уже есть в базе:\n"
+            f"{lines}\n\n"
+            "Возможно, эта достопримечательность уже добавлена. "
+            "Если это не так, продолжайте, или отмените добавление командой /cancel."
+        )
+
 async def edit_landmark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
-        if not is_authorized(chat_id):
+        if not is_authorized(context):
             await update.message.reply_text("❌ Вы не авторизованы! Используйте /start для входа.")
             return ConversationHandler.END
 
@@ -394,27 +494,29 @@ async def edit_landmark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             return ConversationHandler.END
 
         landmark_id = int(args[0])
-        landmark = get_landmark_by_id(landmark_id)
+        landmark = get_landmark_by_id(landmark_id, FULL_COLUMNS)
         if not landmark:
             await update.message.reply_text(f"❌ Достопримечательность с ID {landmark_id} не найдена.")
             return ConversationHandler.END
 
-        temp_data[chat_id] = {"edit_id": landmark_id}
+        context.chat_data["draft"] = {"edit_id": landmark_id}
         await update.message.reply_text(
             f"📝 Редактирование достопримечательности ID {landmark_id}\n"
             f"Текущие данные:\n"
-            f"<b>Название:</b> {landmark['name']}\n"
-            f"<b>Адрес:</b> {landmark['address']}\n"
-            f"<b>Категория:</b> {landmark['category']}\n"
-            f"<b>Описание:</b> {landmark['description']}\n"
-            f"<b>История:</b> {landmark['history']}\n"
-            f"<b>Координаты:</b> {landmark['latitude']:.6f}, {landmark['longitude']:.6f}\n"
-            f"<b>Имя файла:</b> {landmark['images_name']}\n\n"
+            f"<b>Название:</b> {landmark.name}\n"
+            f"<b>Адрес:</b> {landmark.address}\n"
+            f"<b>Категория:</b> {landmark.category}\n"
+            f"<b>Описание:</b> {landmark.description}\n"
+            f"<b>История:</b> {landmark.history}\n"
+            f"<b>Координаты:</b> {landmark.latitude:.6f}, {landmark.longitude:.6f}\n"
+            f"<b>Имя файла:</b> {landmark.images_name}\n\n"
             "Выберите поле для редактирования:",
             parse_mode="HTML",
             reply_markup=edit_field_keyboard
         )
         return EDIT_FIELD
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in edit_landmark handler: {e}")
         await update.message.reply_text(
@@ -424,7 +526,6 @@ async def edit_landmark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
         field = update.message.text
 
         field_map = {
@@ -444,7 +545,7 @@ async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return EDIT_FIELD
 
-        temp_data[chat_id]["edit_field"] = field_map[field]
+        context.chat_data["draft"]["edit_field"] = field_map[field]
         
         if field == "Категория":
             await update.message.reply_text(
@@ -463,7 +564,7 @@ async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             await update.message.reply_text(
                 "📸 Отправьте новую фотографию достопримечательности:"
             )
-            temp_data[chat_id]["awaiting_photo"] = True
+            context.chat_data["draft"]["awaiting_photo"] = True
             return EDIT_VALUE
         else:
             await update.message.reply_text(
@@ -472,6 +573,8 @@ async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
 
         return EDIT_VALUE
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in edit_field handler: {e}")
         await update.message.reply_text(
@@ -481,33 +584,34 @@ async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
-        landmark_id = temp_data[chat_id]["edit_id"]
-        field = temp_data[chat_id]["edit_field"]
+        landmark_id = context.chat_data["draft"]["edit_id"]
+        field = context.chat_data["draft"]["edit_field"]
 
-        if "awaiting_photo" in temp_data[chat_id] and temp_data[chat_id]["awaiting_photo"]:
+        if "awaiting_photo" in context.chat_data["draft"] and context.chat_data["draft"]["awaiting_photo"]:
             photos = update.message.photo
             if not photos:
                 await update.message.reply_text("❌ Пожалуйста, отправьте фотографию.")
                 return EDIT_VALUE
 
             photo = max(photos, key=lambda x: x.file_size)
-            temp_data[chat_id]["photo"] = photo.file_id
+            context.chat_data["draft"]["photo"] = photo.file_id
             await update.message.reply_text(
                 "📝 Введите новое имя файла для фотографии (например: landmark_photo.jpg):"
             )
-            temp_data[chat_id]["awaiting_photo"] = False
+            context.chat_data["draft"]["awaiting_photo"] = False
             return EDIT_VALUE
 
         if field == "images_name":
             images_name = update.message.text
-            if not await save_photo(context.bot, temp_data[chat_id]["photo"], images_name):
+            photo = await save_photo(context.bot, context.chat_data["draft"]["photo"], images_name)
+            if photo is None:
                 await update.message.reply_text(
                     "❌ Ошибка при сохранении фотографии. Попробуйте позже.",
                     reply_markup=continue_keyboard
                 )
                 return ConversationHandler.END
-            success = update_landmark_field(landmark_id, field, images_name)
+            context.application.create_task(asyncio.to_thread(index_photo, images_name, photo))
+            success = await write_behind.update_landmark_field(landmark_id, field, images_name)
         elif field == "location":
             try:
                 lat, lon = map(str.strip, update.message.text.split(','))
@@ -515,7 +619,7 @@ async def edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 lon = float(lon)
                 if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
                     raise ValueError("Неверный диапазон координат")
-                success = update_landmark_field(landmark_id, field, (lat, lon))
+                success = await write_behind.update_landmark_field(landmark_id, field, (lat, lon))
             except (ValueError, IndexError):
                 await update.message.reply_text(
                     "❌ Неверный формат координат. Пожалуйста, введите в формате:\n"
@@ -525,19 +629,19 @@ async def edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 )
                 return EDIT_VALUE
         else:
-            success = update_landmark_field(landmark_id, field, update.message.text)
+            success = await write_behind.update_landmark_field(landmark_id, field, update.message.text)
 
         if success:
-            landmark = get_landmark_by_id(landmark_id)
+            landmark = get_landmark_by_id(landmark_id, FULL_COLUMNS)
             await update.message.reply_text(
                 f"✅ Поле успешно обновлено!\n\n"
-                f"<b>Название:</b> {landmark['name']}\n"
-                f"<b>Адрес:</b> {landmark['address']}\n"
-                f"<b>Категория:</b> {landmark['category']}\n"
-                f"<b>Описание:</b> {landmark['description']}\n"
-                f"<b>История:</b> {landmark['history']}\n"
-                f"<b>Координаты:</b> {landmark['latitude']:.6f}, {landmark['longitude']:.6f}\n"
-                f"<b>Имя файла:</b> {landmark['images_name']}\n\n"
+                f"<b>Название:</b> {landmark.name}\n"
+                f"<b>Адрес:</b> {landmark.address}\n"
+                f"<b>Категория:</b> {landmark.category}\n"
+                f"<b>Описание:</b> {landmark.description}\n"
+                f"<b>История:</b> {landmark.history}\n"
+                f"<b>Координаты:</b> {landmark.latitude:.6f}, {landmark.longitude:.6f}\n"
+                f"<b>Имя файла:</b> {landmark.images_name}\n\n"
                 "Хотите добавить еще одну достопримечательность?",
                 parse_mode="HTML",
                 reply_markup=continue_keyboard
@@ -548,9 +652,10 @@ async def edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 reply_markup=continue_keyboard
             )
 
-        if chat_id in temp_data:
-            del temp_data[chat_id]
+        context.chat_data.pop("draft", None)
         return ConversationHandler.END
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in edit_value handler: {e}")
         await update.message.reply_text(
@@ -560,7 +665,7 @@ async def edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def continue_adding(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        if is_authorized(update.effective_chat.id):
+        if is_authorized(context):
             await update.message.reply_text(
                 "Введите название достопримечательности:",
                 reply_markup=ReplyKeyboardRemove()
@@ -572,6 +677,8 @@ async def continue_adding(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 reply_markup=ReplyKeyboardRemove()
             )
             return ConversationHandler.END
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in continue_adding handler: {e}")
         await update.message.reply_text(
@@ -581,14 +688,14 @@ async def continue_adding(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        chat_id = update.effective_chat.id
-        if chat_id in temp_data:
-            del temp_data[chat_id]
+        context.chat_data.pop("draft", None)
         await update.message.reply_text(
             "❌ Операция отменена.",
             reply_markup=ReplyKeyboardRemove()
         )
         return ConversationHandler.END
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in cancel handler: {e}")
         await update.message.reply_text(
@@ -598,33 +705,72 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        chat_id = update.effective_chat.id
-        if chat_id in authorized_users:
-            authorized_users.remove(chat_id)
-        if chat_id in temp_data:
-            del temp_data[chat_id]
+        context.chat_data.pop("authorized", None)
+        context.chat_data.pop("draft", None)
         await update.message.reply_text(
             "🔒 Вы вышли из системы. Для доступа требуется повторная авторизация.",
             reply_markup=ReplyKeyboardRemove()
         )
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in logout handler: {e}")
         await update.message.reply_text(
             "Произошла ошибка. Пожалуйста, попробуйте снова или обратитесь к администратору."
         )
 
-def is_authorized(chat_id: int) -> bool:
-    return chat_id in authorized_users
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Suggest landmark names for @bot <prefix> from the in-memory index"""
+    global inline_cache_version
+    try:
+        query = update.inline_query.query.strip()
+
+        if inline_cache_version != name_index.version:
+            inline_results_cache.clear()
+            inline_cache_version = name_index.version
+
+        key = query.casefold()
+        results = inline_results_cache.get(key)
+        if results is None:
+            results = [
+                InlineQueryResultArticle(
+                    id=str(landmark_id),
+                    title=landmark_name,
+                    description=f"ID: {landmark_id}",
+                    input_message_content=InputTextMessageContent(landmark_name)
+                )
+                for landmark_id, landmark_name in name_index.search(query)
+            ]
+            if len(inline_results_cache) >= MAX_INLINE_CACHE_ENTRIES:
+                inline_results_cache.clear()
+            inline_results_cache[key] = results
 
-# Команда /list для вывода всех достопримечательностей
+        await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+    except Exception as e:
+        logger.error(f"Error in inline_query handler: {e}")
+
+def is_authorized(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    return context.chat_data.get("authorized", False)
+
+# Команда /list [категория] для вывода достопримечательностей
 MAX_ENTRIES_PER_MSG = 20
 
 async def list_landmarks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        landmarks = get_all_landmarks()
-        if not landmarks:
-            await update.message.reply_text("В базе данных нет достопримечательностей.")
-            return
+        if context.args:
+            category = " ".join(context.args)
+            landmarks = get_landmarks_by_category(category)
+            if not landmarks:
+                await update.message.reply_text(
+                    f"В категории '{category}' нет достопримечательностей.\n"
+                    f"Доступные категории: {', '.join(CATEGORIES)}"
+                )
+                return
+        else:
+            landmarks = get_all_landmarks()
+            if not landmarks:
+                await update.message.reply_text("В базе данных нет достопримечательностей.")
+                return
 
         # Разбиваем список на чанки по 20 записей
         for i in range(0, len(landmarks), MAX_ENTRIES_PER_MSG):
@@ -632,22 +778,50 @@ async def list_landmarks(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             msg = "📚 Список достопримечательностей:\n\n"
             for lm in chunk:
                 msg += (
-                    f"ID: {lm[0]}\n"
-                    f"Название: {lm[1]}\n"
-                    f"Категория: {lm[3]}\n"
-                    f"Адрес: {lm[2]}\n\n"
+                    f"ID: {lm.id}\n"
+                    f"Название: {lm.name}\n"
+                    f"Категория: {lm.category}\n"
+                    f"Адрес: {lm.address}\n\n"
                 )
             await update.message.reply_text(msg)
 
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in list_landmarks handler: {e}")
         await update.message.reply_text("Ошибка при получении списка достопримечательностей.")
 
+# Команда /stats для вывода количества достопримечательностей по категориям и регионам
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        rows = get_landmark_stats()
+        if not rows:
+            await update.message.reply_text("В базе данных нет достопримечательностей.")
+            return
+
+        by_category = {}
+        by_region = {}
+        for category_name, region, count in rows:
+            by_category[category_name] = by_category.get(category_name, 0) + count
+            by_region[region] = by_region.get(region, 0) + count
+
+        msg = f"📊 Всего достопримечательностей: {sum(by_category.values())}\n\n<b>По категориям:</b>\n"
+        for category_name, count in sorted(by_category.items(), key=lambda item: -item[1]):
+            msg += f"{html.escape(category_name)}: {count}\n"
+        msg += "\n<b>По регионам:</b>\n"
+        for region, count in sorted(by_region.items(), key=lambda item: -item[1]):
+            msg += f"{html.escape(region)}: {count}\n"
+        await update.message.reply_text(msg, parse_mode="HTML")
+    except DatabaseUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"Error in stats handler: {e}")
+        await update.message.reply_text("Ошибка при получении статистики.")
+
 # Команда /delete <id> для удаления записи по ID
 async def delete_landmark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        chat_id = update.effective_chat.id
-        if not is_authorized(chat_id):
+        if not is_authorized(context):
             await update.message.reply_text("❌ Вы не авторизованы! Используйте /start для входа.")
             return
 
@@ -657,18 +831,45 @@ async def delete_landmark(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
         landmark_id = int(args[0])
-        deleted = delete_landmark_by_id(landmark_id)
+        deleted = await write_behind.delete_landmark_by_id(landmark_id)
         if deleted:
             await update.message.reply_text(f"✅ Достопримечательность с ID {landmark_id} удалена.")
         else:
             await update.message.reply_text(f"❌ Достопримечательность с ID {landmark_id} не найдена.")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error in delete_landmark handler: {e}")
         await update.message.reply_text("Ошибка при удалении достопримечательности.")
 
-def main():
-    request = HTTPXRequest(proxy_url=PROXY_URL) if PROXY_URL else None
-    application = Application.builder().token(BOT_TOKEN).request(request).build()
+def mark_not_ready():
+    if os.path.exists(READY_FILE):
+        os.remove(READY_FILE)
+
+def mark_ready():
+    with open(READY_FILE, 'w') as f:
+        f.write(datetime.now().isoformat())
+    logger.info("Bot is ready")
+
+async def mark_ready_when_warm(application: Application) -> None:
+    """Write the readiness file once the database pool is warmed up"""
+    await asyncio.to_thread(wait_until_ready)
+    mark_ready()
+
+async def post_init(application: Application) -> None:
+    application.create_task(mark_ready_when_warm(application))
+    start_name_index()
+
+def build_application(persistence: PostgresPersistence) -> Application:
+    builder = Application.builder().token(BOT_TOKEN).post_init(post_init).persistence(persistence)
+    if PROXY_URL:
+        builder = builder.request(HTTPXRequest(proxy_url=PROXY_URL))
+    application = builder.build()
+
+    # Привязка сессии БД выполняется раньше всех остальных обработчиков
+    # Пока база недоступна, обновления отклоняются ещё до привязки сессии
+    application.add_handler(TypeHandler(Update, database_guard), group=-2)
+    application.add_handler(TypeHandler(Update, bind_db_session), group=-1)
 
     # Основной конверсершн хендлер для регистрации/добавления
     conv_handler = ConversationHandler(
@@ -696,18 +897,104 @@ def main():
         fallbacks=[
             CommandHandler('cancel', cancel), 
             MessageHandler(filters.Regex('^(Продолжить добавление)$'), continue_adding)
-        ]
+        ],
+        name="landmark",
+        persistent=True
     )
     application.add_handler(conv_handler)
 
     # Другие команды
     application.add_handler(CommandHandler("list", list_landmarks))
+    application.add_handler(CommandHandler("stats", stats))
     application.add_handler(CommandHandler("delete", delete_landmark))
     application.add_handler(CommandHandler("logout", logout))
+    application.add_handler(InlineQueryHandler(inline_query))
 
     application.add_error_handler(error_handler)
+    return application
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бот для добавления достопримечательностей")
+    parser.add_argument(
+        '--role', choices=['single', 'poller', 'worker'], default=os.getenv('BOT_ROLE', 'single'),
+        help="single - один процесс; poller - получает обновления; worker - обрабатывает свой шард"
+    )
+    parser.add_argument('--shards', type=int, default=int(os.getenv('WORKER_SHARDS', '1')), help="число шардов")
+    parser.add_argument('--shard', default=os.getenv('WORKER_SHARD', 'auto'), help="номер шарда воркера или auto")
+    return parser.parse_args()
+
+def shutdown():
+    """Release resources after the update loop has drained"""
+    mark_not_ready()
+    # Изменения из очереди write-behind записываются до закрытия пула
+    write_behind.stop_write_behind(float(os.getenv('SHUTDOWN_FLUSH_SECONDS', '10')))
+    close_db_pool()
+    logger.info("Shutdown complete")
+
+def main():
+    args = parse_args()
+    mark_not_ready()
+
+    # Проверяем конфигурацию один раз при старте
+    check_config()
+    configure()
+
+    # Обновления из Telegram получает только один процесс: bot и poller вместе не запускаются
+    polling_conn = claim_polling() if args.role != 'worker' else None
+
+    # Миграции и прогрев пула выполняются в фоне, пока бот подключается к Telegram:
+    # недоступная при старте база или долгий CREATE INDEX CONCURRENTLY не мешают
+    # запуску, ошибки повторяются с нарастающей задержкой. Готовность (READY_FILE)
+    # выставляется только после миграций. Чтобы новые обработчики не видели старую
+    # схему при первом деплое, миграции можно выполнить заранее отдельной командой
+    # (python migrate.py) и запускать бота с MIGRATE_ON_STARTUP=0
+    migrate = run_migrations if MIGRATE_ON_STARTUP and args.role != 'worker' else None
+    start_pool_warmup(migrate)
+
+    # Периодический отчёт о самых тяжёлых запросах
+    start_report_thread()
+
+    # По SIGTERM цикл обновлений перестаёт брать новые, дожидается текущего
+    # (SHUTDOWN_DRAIN_SECONDS) и возвращается, после чего закрываются ресурсы
+    try:
+        if args.role == 'poller':
+            # Фоновая сверка изображений и досчёт хэшей фотографий нужны в одном
+            # экземпляре, их выполняет poller
+            start_gc_thread()
+            start_photo_index()
+            wait_until_ready()
+            mark_ready()
+            request = HTTPXRequest(proxy_url=PROXY_URL) if PROXY_URL else None
+            asyncio.run(run_poller(Bot(BOT_TOKEN, request=request), args.shards))
+            return
+
+        if args.role == 'worker':
+            shard, lock_conn = claim_shard(args.shards, args.shard)
+            application = build_application(PostgresPersistence(shard, args.shards, update_interval=PERSISTENCE_INTERVAL))
+            # Изменения, сделанные другими воркерами, приходят через NOTIFY
+            start_notify_listener()
+            start_photo_index(backfill=False)
+            write_behind.start_write_behind()
+            try:
+                asyncio.run(run_worker(application, shard, lock_conn))
+            finally:
+                lock_conn.close()
+            return
+
+        application = build_application(PostgresPersistence(update_interval=PERSISTENCE_INTERVAL))
+
+        # Фоновая сверка изображений с базой и досчёт хэшей фотографий
+        start_gc_thread()
+        start_photo_index()
+
+        # Пакетная запись изменений (WRITE_BEHIND=1)
+        write_behind.start_write_behind()
 
-    application.run_polling()
+        asyncio.run(run_single(application))
+    finally:
+        shutdown()
+        if polling_conn is not None:
+            polling_conn.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import os
+import re
+import sys
+from typing import List, NamedTuple
+
+import psycopg2
+
+from db_config import DB_CONFIG, configure
+
+logger = logging.getLogger(__name__)
+
+# Каталог с файлами миграций вида 0001_name.sql
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Ключ advisory-блокировки, чтобы миграции не запускались параллельно из нескольких процессов
+MIGRATION_LOCK_ID = 727001
+
+# Маркер в начале файла: миграция выполняется вне транзакции (нужно для CREATE INDEX CONCURRENTLY).
+# Такие файлы выполняются по одному оператору, и каждый оператор должен быть идемпотентным.
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+
+MIGRATION_FILE_RE = re.compile(r'^(\d+)_([\w-]+)\.sql$')
+CONCURRENT_INDEX_RE = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)',
+    re.IGNORECASE
+)
+
+class MigrationError(Exception):
+    """Raised when the migration history does not match the files on disk"""
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+    checksum: str
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """Read migration files from disk, ordered by version"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE_RE.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(directory, filename), 'rb') as f:
+            raw = f.read()
+        migrations.append(Migration(
+            version=int(match.group(1)),
+            name=match.group(2),
+            sql=raw.decode('utf-8'),
+            checksum=hashlib.sha256(raw).hexdigest()
+        ))
+
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError(f"Duplicate migration versions in {directory}")
+    migrations.sort(key=lambda m: m.version)
+    return migrations
+
+def split_statements(sql: str) -> List[str]:
+    """Split a no-transaction migration into separate statements"""
+    statements = []
+    for chunk in re.split(r';\s*$', sql, flags=re.MULTILINE):
+        lines = [line for line in chunk.splitlines() if not line.strip().startswith('--')]
+        statement = "\n".join(lines).strip()
+        if statement:
+            statements.append(statement)
+    return statements
+
+def ensure_migrations_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name text NOT NULL,
+                checksum text NOT NULL,
+                applied_at timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+
+def get_applied(conn) -> dict:
+    """Return applied migrations as {version: (name, checksum)}"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT version, name, checksum FROM schema_migrations ORDER BY version")
+        return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+def verify_checksums(migrations: List[Migration], applied: dict):
+    """Make sure applied migrations were not edited afterwards"""
+    for migration in migrations:
+        if migration.version in applied and applied[migration.version][1] != migration.checksum:
+            raise MigrationError(
+                f"Checksum mismatch for migration {migration.version}_{migration.name}: "
+                f"the file was changed after it was applied"
+            )
+
+def drop_invalid_index(cur, index_name: str):
+    """Drop an index left INVALID by an interrupted CREATE INDEX CONCURRENTLY"""
+    cur.execute("""
+        SELECT NOT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s
+    """, (index_name,))
+    row = cur.fetchone()
+    if row and row[0]:
+        logger.warning(f"Dropping invalid index {index_name} left by an interrupted build")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+def apply_migration(conn, migration: Migration):
+    """Apply a single migration and record it in schema_migrations"""
+    logger.info(f"Applying migration {migration.version}_{migration.name}")
+    record_sql = "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)"
+    record_args = (migration.version, migration.name, migration.checksum)
+
+    if migration.transactional:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute(migration.sql)
+                cur.execute(record_sql, record_args)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+    else:
+        with conn.cursor() as cur:
+            # Построение индекса на большой таблице может занять долго
+            cur.execute("SET statement_timeout = 0")
+            for statement in split_statements(migration.sql):
+                match = CONCURRENT_INDEX_RE.match(statement)
+                if match:
+                    drop_invalid_index(cur, match.group(1))
+                cur.execute(statement)
+            cur.execute(record_sql, record_args)
+    logger.info(f"Migration {migration.version}_{migration.name} applied")
+
+def run_migrations(directory: str = MIGRATIONS_DIR) -> int:
+    """Apply all pending migrations, returns the number of applied migrations"""
+    configure()
+    migrations = load_migrations(directory)
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            ensure_migrations_table(conn)
+            applied = get_applied(conn)
+            verify_checksums(migrations, applied)
+
+            pending = [m for m in migrations if m.version not in applied]
+            for migration in pending:
+                apply_migration(conn, migration)
+            if pending:
+                logger.info(f"Applied {len(pending)} migration(s)")
+            else:
+                logger.info("Database schema is up to date")
+            return len(pending)
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    finally:
+        conn.close()
+
+def print_status(directory: str = MIGRATIONS_DIR):
+    """Print applied and pending migrations"""
+    configure()
+    migrations = load_migrations(directory)
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    try:
+        ensure_migrations_table(conn)
+        applied = get_applied(conn)
+    finally:
+        conn.close()
+
+    for migration in migrations:
+        if migration.version not in applied:
+            state = 'pending'
+        elif applied[migration.version][1] != migration.checksum:
+            state = 'CHECKSUM MISMATCH'
+        else:
+            state = 'applied'
+        print(f"{migration.version:04d}_{migration.name}: {state}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'up'
+    if command == 'up':
+        run_migrations()
+    elif command == 'status':
+        print_status()
+    else:
+        print("Использование: python migrate.py [up|status]")
+        sys.exit(1)
@@ -0,0 +1,27 @@
+-- Базовая схема: таблицы landmark и category и последовательность для id.
+-- Все операторы идемпотентны, чтобы миграцию можно было применить к уже
+-- существующей базе.
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+CREATE SEQUENCE IF NOT EXISTS landmark_id_seq;
+
+CREATE TABLE IF NOT EXISTS landmark (
+    id integer PRIMARY KEY DEFAULT nextval('landmark_id_seq'),
+    name text NOT NULL,
+    address text,
+    category text,
+    description text,
+    history text,
+    photo bytea,
+    location geography(Point, 4326),
+    images_name text
+);
+
+ALTER SEQUENCE landmark_id_seq OWNED BY landmark.id;
+SELECT setval('landmark_id_seq', COALESCE((SELECT MAX(id) FROM landmark), 0) + 1, false);
+
+CREATE TABLE IF NOT EXISTS category (
+    id serial PRIMARY KEY,
+    landmark_id integer REFERENCES landmark (id) ON DELETE CASCADE,
+    category_name text
+);
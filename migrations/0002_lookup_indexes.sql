@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- Индексы для поиска по имени и для соединения с category.
+-- CONCURRENTLY не блокирует запись в таблицу, но не работает внутри транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS landmark_name_idx ON landmark (name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS category_landmark_id_idx ON category (landmark_id);
@@ -0,0 +1,18 @@
+-- Метки времени и мягкое удаление для инкрементальной синхронизации (changes.py).
+-- Значения по умолчанию стабильные, поэтому ADD COLUMN не переписывает таблицу.
+ALTER TABLE landmark ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE landmark ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE landmark ADD COLUMN IF NOT EXISTS deleted_at timestamptz;
+
+-- updated_at выставляется триггером при любом изменении строки, включая мягкое удаление
+CREATE OR REPLACE FUNCTION landmark_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS landmark_touch_updated_at ON landmark;
+CREATE TRIGGER landmark_touch_updated_at
+    BEFORE INSERT OR UPDATE ON landmark
+    FOR EACH ROW EXECUTE FUNCTION landmark_touch_updated_at();
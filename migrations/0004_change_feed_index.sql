@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Индекс для выборки изменений по курсору (updated_at, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS landmark_updated_at_idx ON landmark (updated_at, id);
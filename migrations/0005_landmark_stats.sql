@@ -0,0 +1,59 @@
+-- Счётчики достопримечательностей по категории и региону.
+-- Поддерживаются триггерами при вставке, изменении и удалении, поэтому /stats
+-- читает маленькую таблицу вместо GROUP BY по всей landmark.
+CREATE TABLE IF NOT EXISTS landmark_stats (
+    category text NOT NULL,
+    region text NOT NULL,
+    landmark_count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, region)
+);
+
+-- Регион - первая часть адреса до запятой ("Республика Крым, Ялта, ..." -> "Республика Крым")
+CREATE OR REPLACE FUNCTION landmark_region(address text) RETURNS text AS $$
+    SELECT COALESCE(NULLIF(btrim(split_part(address, ',', 1)), ''), 'Не указан')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION landmark_stats_apply(p_category text, p_address text, p_delta integer) RETURNS void AS $$
+BEGIN
+    INSERT INTO landmark_stats (category, region, landmark_count)
+    VALUES (COALESCE(NULLIF(btrim(p_category), ''), 'Без категории'), landmark_region(p_address), p_delta)
+    ON CONFLICT (category, region)
+    DO UPDATE SET landmark_count = landmark_stats.landmark_count + EXCLUDED.landmark_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удалённые (deleted_at IS NOT NULL) строки в счётчиках не учитываются
+CREATE OR REPLACE FUNCTION landmark_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.deleted_at IS NULL THEN
+        PERFORM landmark_stats_apply(OLD.category, OLD.address, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.deleted_at IS NULL THEN
+        PERFORM landmark_stats_apply(NEW.category, NEW.address, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS landmark_stats_insert_delete ON landmark;
+CREATE TRIGGER landmark_stats_insert_delete
+    AFTER INSERT OR DELETE ON landmark
+    FOR EACH ROW EXECUTE FUNCTION landmark_stats_trigger();
+
+DROP TRIGGER IF EXISTS landmark_stats_update ON landmark;
+CREATE TRIGGER landmark_stats_update
+    AFTER UPDATE OF category, address, deleted_at ON landmark
+    FOR EACH ROW
+    WHEN (OLD.category IS DISTINCT FROM NEW.category
+          OR OLD.address IS DISTINCT FROM NEW.address
+          OR OLD.deleted_at IS DISTINCT FROM NEW.deleted_at)
+    EXECUTE FUNCTION landmark_stats_trigger();
+
+-- Первичное заполнение; запись в landmark на время пересчёта блокируется
+LOCK TABLE landmark IN SHARE MODE;
+TRUNCATE landmark_stats;
+INSERT INTO landmark_stats (category, region, landmark_count)
+SELECT COALESCE(NULLIF(btrim(category), ''), 'Без категории'), landmark_region(address), count(*)
+FROM landmark
+WHERE deleted_at IS NULL
+GROUP BY 1, 2;
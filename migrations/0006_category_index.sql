@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Индекс для /list <категория> по живым строкам
+CREATE INDEX CONCURRENTLY IF NOT EXISTS landmark_category_idx ON landmark (category, id) WHERE deleted_at IS NULL;
@@ -0,0 +1,66 @@
+-- Кластеры для карты: число точек и суммы координат по ячейкам geohash
+-- точностью от 1 до 7 символов. Поддерживаются триггерами, центр кластера
+-- считается как sum_lat / landmark_count, sum_lon / landmark_count.
+CREATE TABLE IF NOT EXISTS landmark_cluster (
+    precision smallint NOT NULL,
+    geohash text NOT NULL,
+    landmark_count bigint NOT NULL DEFAULT 0,
+    sum_lat double precision NOT NULL DEFAULT 0,
+    sum_lon double precision NOT NULL DEFAULT 0,
+    PRIMARY KEY (precision, geohash)
+);
+
+CREATE OR REPLACE FUNCTION landmark_cluster_apply(p_location geography, p_delta integer) RETURNS void AS $$
+DECLARE
+    geom geometry;
+    p integer;
+BEGIN
+    IF p_location IS NULL THEN
+        RETURN;
+    END IF;
+    geom := p_location::geometry;
+    FOR p IN 1..7 LOOP
+        INSERT INTO landmark_cluster (precision, geohash, landmark_count, sum_lat, sum_lon)
+        VALUES (p, ST_GeoHash(geom, p), p_delta, p_delta * ST_Y(geom), p_delta * ST_X(geom))
+        ON CONFLICT (precision, geohash) DO UPDATE SET
+            landmark_count = landmark_cluster.landmark_count + EXCLUDED.landmark_count,
+            sum_lat = landmark_cluster.sum_lat + EXCLUDED.sum_lat,
+            sum_lon = landmark_cluster.sum_lon + EXCLUDED.sum_lon;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION landmark_cluster_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.deleted_at IS NULL THEN
+        PERFORM landmark_cluster_apply(OLD.location, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.deleted_at IS NULL THEN
+        PERFORM landmark_cluster_apply(NEW.location, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS landmark_cluster_insert_delete ON landmark;
+CREATE TRIGGER landmark_cluster_insert_delete
+    AFTER INSERT OR DELETE ON landmark
+    FOR EACH ROW EXECUTE FUNCTION landmark_cluster_trigger();
+
+DROP TRIGGER IF EXISTS landmark_cluster_update ON landmark;
+CREATE TRIGGER landmark_cluster_update
+    AFTER UPDATE OF location, deleted_at ON landmark
+    FOR EACH ROW
+    WHEN (ST_AsBinary(OLD.location) IS DISTINCT FROM ST_AsBinary(NEW.location)
+          OR OLD.deleted_at IS DISTINCT FROM NEW.deleted_at)
+    EXECUTE FUNCTION landmark_cluster_trigger();
+
+-- Первичное заполнение; запись в landmark на время пересчёта блокируется
+LOCK TABLE landmark IN SHARE MODE;
+TRUNCATE landmark_cluster;
+INSERT INTO landmark_cluster (precision, geohash, landmark_count, sum_lat, sum_lon)
+SELECT p, ST_GeoHash(location::geometry, p), count(*),
+       sum(ST_Y(location::geometry)), sum(ST_X(location::geometry))
+FROM landmark, generate_series(1, 7) AS p
+WHERE deleted_at IS NULL AND location IS NOT NULL
+GROUP BY 1, 2;
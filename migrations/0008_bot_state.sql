@@ -0,0 +1,48 @@
+-- Общее состояние для нескольких процессов бота (workers.py):
+-- очередь обновлений, распределённых по шардам, данные чатов и состояния диалогов.
+CREATE TABLE IF NOT EXISTS bot_update_queue (
+    update_id bigint PRIMARY KEY,
+    shard integer NOT NULL,
+    chat_key bigint NOT NULL,
+    payload jsonb NOT NULL,
+    received_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS bot_update_queue_shard_idx ON bot_update_queue (shard, update_id);
+
+CREATE TABLE IF NOT EXISTS bot_chat_data (
+    chat_id bigint PRIMARY KEY,
+    data jsonb NOT NULL DEFAULT '{}'::jsonb,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS bot_conversation (
+    name text NOT NULL,
+    key text NOT NULL,
+    state jsonb NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (name, key)
+);
+
+-- Уведомления о смене имени или удалении, чтобы все процессы обновили индекс имён
+CREATE OR REPLACE FUNCTION landmark_notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('landmark_changes', json_build_object(
+        'id', NEW.id,
+        'name', NEW.name,
+        'deleted', NEW.deleted_at IS NOT NULL
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS landmark_notify_insert ON landmark;
+CREATE TRIGGER landmark_notify_insert
+    AFTER INSERT ON landmark
+    FOR EACH ROW EXECUTE FUNCTION landmark_notify_change();
+
+DROP TRIGGER IF EXISTS landmark_notify_update ON landmark;
+CREATE TRIGGER landmark_notify_update
+    AFTER UPDATE OF name, deleted_at ON landmark
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name OR OLD.deleted_at IS DISTINCT FROM NEW.deleted_at)
+    EXECUTE FUNCTION landmark_notify_change();
@@ -0,0 +1,7 @@
+-- Перцептивные хэши (dHash, 64 бита) сохранённых фотографий для поиска
+-- визуальных дубликатов (photo_hash.py). Ключ - имя файла в хранилище.
+CREATE TABLE IF NOT EXISTS photo_hash (
+    images_name text PRIMARY KEY,
+    hash bigint NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Поиск достопримечательностей по имени файла фотографии для предупреждений о дубликатах.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS landmark_images_name_idx ON landmark (images_name) WHERE deleted_at IS NULL;
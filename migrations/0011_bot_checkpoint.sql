@@ -0,0 +1,8 @@
+-- Последний обработанный (single) или поставленный в очередь (poller) update_id.
+-- После перезапуска обновления не старше контрольной точки пропускаются,
+-- а опрос Telegram продолжается со следующего.
+CREATE TABLE IF NOT EXISTS bot_checkpoint (
+    name text PRIMARY KEY,
+    update_id bigint NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,3 @@
+-- Файлы, которые не удалось декодировать, записываются с hash = NULL,
+-- чтобы досчёт хэшей (photo_hash.backfill_hashes) не читал их при каждом запуске.
+ALTER TABLE photo_hash ALTER COLUMN hash DROP NOT NULL;
@@ -0,0 +1,16 @@
+-- Курсор ленты изменений по номеру транзакции вместо updated_at (changes.py).
+-- updated_at берётся в момент записи, и транзакция, закоммиченная позже других,
+-- могла оказаться позади уже сдвинутого курсора. change_xid - номер транзакции,
+-- последней изменившей строку; лента отдаёт только строки транзакций младше xmin
+-- текущего снимка, то есть уже завершённых, поэтому курсор их не перепрыгивает.
+-- Постоянное значение по умолчанию не переписывает таблицу: старые строки
+-- получают 0 и считаются изменёнными раньше всех новых.
+ALTER TABLE landmark ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION landmark_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    NEW.change_xid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
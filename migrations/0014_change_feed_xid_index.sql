@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Индекс для выборки изменений по курсору (change_xid, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS landmark_change_xid_idx ON landmark (change_xid, id);
@@ -0,0 +1,90 @@
+from typing import Iterable, Sequence, Tuple
+
+# SQL-выражение для каждого поля Landmark (таблица landmark)
+COLUMN_SQL = {
+    'id': 'id',
+    'name': 'name',
+    'address': 'address',
+    'category': 'category',
+    'latitude': 'ST_Y(location::geometry)',
+    'longitude': 'ST_X(location::geometry)',
+    'images_name': 'images_name',
+    'description': 'description',
+    'history': 'history',
+}
+
+# Наборы колонок для типовых запросов
+LIST_COLUMNS = ('id', 'name', 'address', 'category')
+CARD_COLUMNS = ('id', 'name', 'address', 'category', 'latitude', 'longitude', 'images_name')
+FULL_COLUMNS = CARD_COLUMNS + ('description', 'history')
+
+# Большие текстовые поля, которые догружаются при первом обращении
+LAZY_COLUMNS = ('description', 'history')
+
+NOT_LOADED = object()
+
+def select_list(columns: Sequence[str]) -> str:
+    """SQL select list for the given Landmark fields, in the same order"""
+    return ', '.join(COLUMN_SQL[column] for column in columns)
+
+class Landmark:
+    """A landmark row with only the projected columns
+
+    Fields that were not selected raise AttributeError, except description and
+    history, which are loaded from the database on first access.
+    """
+
+    __slots__ = ('id', 'name', 'address', 'category', 'latitude', 'longitude', 'images_name',
+                 '_description', '_history')
+
+    def __init__(self, **fields):
+        self._description = NOT_LOADED
+        self._history = NOT_LOADED
+        for column, value in fields.items():
+            setattr(self, column, value)
+
+    @classmethod
+    def from_row(cls, columns: Sequence[str], row: Tuple) -> 'Landmark':
+        return cls(**dict(zip(columns, row)))
+
+    @property
+    def description(self) -> str:
+        if self._description is NOT_LOADED:
+            self.load_texts()
+        return self._description
+
+    @description.setter
+    def description(self, value: str):
+        self._description = value
+
+    @property
+    def history(self) -> str:
+        if self._history is NOT_LOADED:
+            self.load_texts()
+        return self._history
+
+    @history.setter
+    def history(self, value: str):
+        self._history = value
+
+    def load_texts(self):
+        load_texts([self])
+
+    def __repr__(self):
+        return f"Landmark(id={getattr(self, 'id', None)!r}, name={getattr(self, 'name', None)!r})"
+
+def load_texts(landmarks: Iterable[Landmark]):
+    """Load description and history for many landmarks with a single query"""
+    pending = {landmark.id: landmark for landmark in landmarks
+               if landmark._description is NOT_LOADED or landmark._history is NOT_LOADED}
+    if not pending:
+        return
+    # db_config сам импортирует models, поэтому импорт отложен до первого вызова
+    import db_config
+    texts = db_config.get_landmark_texts(list(pending))
+    for landmark_id, landmark in pending.items():
+        description, history = texts.get(landmark_id, (None, None))
+        if landmark._description is NOT_LOADED:
+            landmark._description = description
+        if landmark._history is NOT_LOADED:
+            landmark._history = history
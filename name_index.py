@@ -0,0 +1,176 @@
+import bisect
+import json
+import logging
+import re
+import select
+import threading
+import time
+from typing import Iterable, List, Tuple
+
+import psycopg2
+
+import db_config
+from db_config import add_change_listener, get_landmark_names
+
+logger = logging.getLogger(__name__)
+
+# Сколько подсказок отдавать на один запрос
+MAX_SUGGESTIONS = 20
+
+# Канал NOTIFY триггеров landmark_notify_* (миграция 0008)
+CHANGES_CHANNEL = 'landmark_changes'
+
+notify_thread = None
+build_thread = None
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def index_keys(name: str) -> List[str]:
+    """Keys under which a name is found: the whole name and every word start
+
+    "Ласточкино гнездо" is found both by "ласт" and by "гнез".
+    """
+    folded = name.casefold()
+    keys = [folded]
+    for match in WORD_RE.finditer(folded):
+        if match.start() > 0:
+            keys.append(folded[match.start():])
+    return keys
+
+class NamePrefixIndex:
+    """Sorted array of (key, landmark_id) answering prefix queries with bisect"""
+
+    def __init__(self):
+        self.entries = []
+        self.names = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def build(self, rows: Iterable[Tuple[int, str]]):
+        """Replace the index contents with (id, name) rows"""
+        names = {landmark_id: name for landmark_id, name in rows}
+        entries = sorted((key, landmark_id) for landmark_id, name in names.items() for key in index_keys(name))
+        with self.lock:
+            self.names = names
+            self.entries = entries
+            self.version += 1
+        logger.info(f"Name index built: {len(names)} names, {len(entries)} keys")
+
+    def add(self, landmark_id: int, name: str):
+        with self.lock:
+            self._remove(landmark_id)
+            self.names[landmark_id] = name
+            for key in index_keys(name):
+                bisect.insort(self.entries, (key, landmark_id))
+            self.version += 1
+
+    def remove(self, landmark_id: int):
+        with self.lock:
+            self._remove(landmark_id)
+            self.version += 1
+
+    def _remove(self, landmark_id: int):
+        name = self.names.pop(landmark_id, None)
+        if name is None:
+            return
+        for key in index_keys(name):
+            i = bisect.bisect_left(self.entries, (key, landmark_id))
+            if i < len(self.entries) and self.entries[i] == (key, landmark_id):
+                del self.entries[i]
+
+    def search(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[Tuple[int, str]]:
+        """Return up to `limit` (id, name) pairs whose name or a word in it starts with prefix"""
+        prefix = prefix.strip().casefold()
+        results = []
+        seen = set()
+        with self.lock:
+            if not prefix:
+                for landmark_id, name in self.names.items():
+                    results.append((landmark_id, name))
+                    if len(results) >= limit:
+                        break
+                return results
+            i = bisect.bisect_left(self.entries, (prefix,))
+            while i < len(self.entries) and len(results) < limit:
+                key, landmark_id = self.entries[i]
+                if not key.startswith(prefix):
+                    break
+                if landmark_id not in seen:
+                    seen.add(landmark_id)
+                    results.append((landmark_id, self.names[landmark_id]))
+                i += 1
+        return results
+
+    def __len__(self):
+        return len(self.names)
+
+name_index = NamePrefixIndex()
+
+def on_landmark_change(action: str, landmark_id: int, fields: dict):
+    """Keep the index in sync with committed writes"""
+    if action == 'delete':
+        name_index.remove(landmark_id)
+    elif 'name' in fields:
+        name_index.add(landmark_id, fields['name'])
+
+def load_name_index():
+    """Subscribe to changes, then build the index once the database is up
+
+    The build is retried with backoff, so autocomplete does not stay empty when
+    the database was unreachable at startup.
+    """
+    add_change_listener(on_landmark_change)
+    db_config.wait_until_ready()
+    delay = 1
+    while True:
+        try:
+            name_index.build(get_landmark_names())
+            return
+        except Exception as e:
+            logger.warning(f"Name index build failed, retrying in {delay}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+def start_name_index():
+    """Build the index in a background thread"""
+    global build_thread
+    if build_thread is not None:
+        return
+    build_thread = threading.Thread(target=load_name_index, name='name-index-build', daemon=True)
+    build_thread.start()
+
+def _listen_loop():
+    conn = psycopg2.connect(**db_config.DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CHANGES_CHANNEL}")
+    while True:
+        if select.select([conn], [], [], 60) == ([], [], []):
+            continue
+        conn.poll()
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                change = json.loads(notify.payload)
+                if change['deleted']:
+                    name_index.remove(change['id'])
+                else:
+                    name_index.add(change['id'], change['name'])
+            except Exception as e:
+                logger.error(f"Bad landmark change notification {notify.payload!r}: {e}")
+
+def _listen_forever():
+    while True:
+        try:
+            _listen_loop()
+        except Exception as e:
+            logger.error(f"Landmark change listener failed, reconnecting: {e}")
+            threading.Event().wait(5)
+
+def start_notify_listener():
+    """Apply landmark changes committed by other processes (multi-worker mode)"""
+    global notify_thread
+    if notify_thread is not None:
+        return
+    notify_thread = threading.Thread(target=_listen_forever, name='name-index-listener', daemon=True)
+    notify_thread.start()
@@ -0,0 +1,305 @@
+import argparse
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+import db_config
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Максимальное расстояние Хэмминга между dHash, при котором фото считаются похожими
+DEFAULT_MAX_DISTANCE = 10
+
+backfill_thread = None
+
+# Хэши, добавленные другими процессами (режим с воркерами), подгружаются из таблицы
+# не чаще раза в PHOTO_INDEX_REFRESH_SECONDS
+loaded_until = None
+refreshed_at = 0.0
+refresh_lock = threading.Lock()
+
+def dhash(data: bytes, size: int = 8) -> int:
+    """64-bit difference hash: compares neighbouring pixels of a 9x8 grayscale thumbnail
+
+    Survives recompression, resizing and small colour changes, so the same
+    photo uploaded again yields a hash within a few bits of the original.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('L', (size * 4, size * 4))  # JPEG декодируется сразу в уменьшенном виде
+        pixels = list(image.convert('L').resize((size + 1, size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def to_signed(value: int) -> int:
+    """Store an unsigned 64-bit hash in a bigint column"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance
+
+    A node keeps children keyed by their distance to it; by the triangle
+    inequality a search for radius r only descends into children with keys in
+    [d - r, d + r], so a query touches a small part of the tree.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value: int, item: str):
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            self.size += 1
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                if item not in current[1]:
+                    current[1].append(item)
+                    self.size += 1
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                self.size += 1
+                return
+            current = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, str]]:
+        """Return (distance, item) pairs within max_distance, closest first"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.extend((distance, item) for item in items)
+            for key, child in children.items():
+                if distance - max_distance <= key <= distance + max_distance:
+                    stack.append(child)
+        found.sort()
+        return found
+
+    def __len__(self):
+        return self.size
+
+class PhotoHashIndex:
+    """In-memory BK-tree of all stored photo hashes"""
+
+    def __init__(self):
+        self.tree = BKTree()
+        self.names = set()
+        self.lock = threading.Lock()
+
+    def add(self, images_name: str, value: int):
+        with self.lock:
+            # Перезаписанный файл с тем же именем оставляет в дереве и старый хэш:
+            # лишнее совпадение безвредно, имя всё равно проверяется по базе
+            self.tree.add(value, images_name)
+            self.names.add(images_name)
+
+    def skip(self, images_name: str):
+        """Remember a file that cannot be hashed, so the backfill does not retry it"""
+        with self.lock:
+            self.names.add(images_name)
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, str]]:
+        with self.lock:
+            return self.tree.search(value, max_distance)
+
+    def __contains__(self, images_name: str):
+        return images_name in self.names
+
+    def __len__(self):
+        return len(self.tree)
+
+photo_index = PhotoHashIndex()
+
+def max_distance() -> int:
+    return int(os.getenv('PHOTO_DUPLICATE_DISTANCE', DEFAULT_MAX_DISTANCE))
+
+def store_hash(images_name: str, value: Optional[int]):
+    """Upsert the hash of a stored file; None marks a file that could not be decoded"""
+    conn = db_config.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO photo_hash (images_name, hash)
+                VALUES (%s, %s)
+                ON CONFLICT (images_name) DO UPDATE SET hash = EXCLUDED.hash, created_at = now()
+            """, (images_name, to_signed(value) if value is not None else None))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(conn)
+
+def record_photo(images_name: str, data: bytes) -> Optional[int]:
+    """Hash a stored photo and add it to the table and the in-memory index"""
+    try:
+        value = dhash(data)
+    except Exception as e:
+        logger.warning(f"Cannot compute perceptual hash for {images_name}: {e}")
+        store_hash(images_name, None)
+        photo_index.skip(images_name)
+        return None
+    store_hash(images_name, value)
+    photo_index.add(images_name, value)
+    return value
+
+def index_photo(images_name: str, data: bytes) -> Optional[int]:
+    """Hash a photo save_photo has just stored, using the downloaded bytes"""
+    try:
+        return record_photo(images_name, data)
+    except Exception as e:
+        # Без хэша фото просто не участвует в поиске дубликатов
+        logger.error(f"Error indexing photo {images_name}: {e}")
+        return None
+
+def find_duplicates(data: bytes, distance: Optional[int] = None) -> List[dict]:
+    """Live landmarks whose photo looks like `data`, closest first"""
+    if distance is None:
+        distance = max_distance()
+    refresh_photo_index()
+    matches = photo_index.search(dhash(data), distance)
+    if not matches:
+        return []
+    names = {}
+    for match_distance, images_name in matches:
+        names.setdefault(images_name, match_distance)
+
+    conn = db_config.get_connection(readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, name, images_name
+                FROM landmark
+                WHERE images_name = ANY(%s) AND deleted_at IS NULL
+            """, (list(names),))
+            rows = cur.fetchall()
+    finally:
+        db_config.release_connection(conn)
+
+    duplicates = [
+        {'id': landmark_id, 'name': name, 'images_name': images_name, 'distance': names[images_name]}
+        for landmark_id, name, images_name in rows
+    ]
+    duplicates.sort(key=lambda duplicate: (duplicate['distance'], duplicate['id']))
+    return duplicates
+
+def load_photo_index(since: Optional[datetime] = None) -> int:
+    """Add hashes from the photo_hash table, all of them or those stored after `since`"""
+    global loaded_until, refreshed_at
+    # Читаем с primary и с запасом по времени: строка с более ранним created_at
+    # могла закоммититься позже
+    conn = db_config.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT now()")
+            now = cur.fetchone()[0]
+            cur.execute("""
+                SELECT images_name, hash
+                FROM photo_hash
+                WHERE created_at > %s
+            """, (since - timedelta(seconds=30) if since else datetime(1970, 1, 1),))
+            rows = cur.fetchall()
+        conn.rollback()
+    finally:
+        db_config.release_connection(conn)
+    for images_name, value in rows:
+        if value is None:
+            photo_index.skip(images_name)
+        else:
+            photo_index.add(images_name, to_unsigned(value))
+    loaded_until = now
+    refreshed_at = time.monotonic()
+    if since is None:
+        logger.info(f"Photo hash index loaded: {len(rows)} hashes")
+    return len(rows)
+
+def refresh_photo_index():
+    if loaded_until is None:
+        return
+    interval = float(os.getenv('PHOTO_INDEX_REFRESH_SECONDS', '5'))
+    if time.monotonic() - refreshed_at < interval:
+        return
+    with refresh_lock:
+        if time.monotonic() - refreshed_at >= interval:
+            load_photo_index(loaded_until)
+
+def backfill_hashes() -> int:
+    """Hash stored photos that have no entry yet (photos saved before this index existed)"""
+    backend = get_storage()
+    hashed = 0
+    for stored in backend.iter_files():
+        if stored.name in photo_index:
+            continue
+        try:
+            if record_photo(stored.name, backend.load(stored.name)) is not None:
+                hashed += 1
+        except Exception as e:
+            logger.error(f"Error hashing stored photo {stored.name}: {e}")
+    logger.info(f"Photo hash backfill finished: {hashed} new hashes, {len(photo_index)} in index")
+    return hashed
+
+def _load_and_backfill(backfill: bool):
+    db_config.wait_until_ready()
+    try:
+        load_photo_index()
+        if backfill:
+            backfill_hashes()
+    except Exception as e:
+        logger.error(f"Error loading photo hash index: {e}")
+
+def start_photo_index(backfill: bool = True):
+    """Load the index in a background thread, then hash missing photos if `backfill`
+
+    The backfill lists the whole image store, so only one process should run it.
+    """
+    global backfill_thread
+    if backfill_thread is not None:
+        return
+    backfill_thread = threading.Thread(target=_load_and_backfill, args=(backfill,), name='photo-hash-index', daemon=True)
+    backfill_thread.start()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Поиск визуально похожих фотографий")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('backfill', help="посчитать хэши для всех сохранённых фотографий")
+    check_parser = subparsers.add_parser('check', help="найти достопримечательности с похожей фотографией")
+    check_parser.add_argument('path', help="файл изображения")
+    check_parser.add_argument('--distance', type=int, default=None)
+    args = parser.parse_args()
+
+    db_config.configure()
+    load_photo_index()
+    if args.command == 'backfill':
+        backfill_hashes()
+    elif args.command == 'check':
+        with open(args.path, 'rb') as f:
+            for duplicate in find_duplicates(f.read(), args.distance):
+                print(f"{duplicate['distance']:2d}  ID {duplicate['id']}  {duplicate['name']}  ({duplicate['images_name']})")
@@ -0,0 +1,241 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# Порог медленного запроса и доля медленных запросов, для которых снимается план
+# (перечитываются из окружения в load_settings() после загрузки .env)
+SLOW_QUERY_MS = 200.0
+EXPLAIN_SAMPLE_RATE = 0.1
+QUERY_REPORT_INTERVAL = 3600
+QUERY_REPORT_TOP_N = 10
+
+# Максимальная длина параметров и текста запроса в логе
+MAX_PARAMS_LOG_LEN = 500
+MAX_QUERY_LOG_LEN = 1000
+
+# Сколько разных запросов хранится в статистике; остальные попадают в общий ключ
+MAX_TRACKED_QUERIES = 1000
+OTHER_QUERIES_KEY = '(other statements)'
+
+# Литералы, которые заменяются на ? при построении ключа статистики.
+# execute_values подставляет значения прямо в текст запроса, и без этого каждая
+# пачка становилась бы отдельным ключом вместе со всеми описаниями и фотографиями
+STRING_LITERAL_RE = re.compile(r"(?:\b[EeBbXxUu]&?)?'[^']*(?:''[^']*)*'")
+NUMBER_LITERAL_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+VALUES_RE = re.compile(r'\bVALUES\s*(?=\()', re.IGNORECASE)
+IN_LIST_RE = re.compile(r'\bIN \((?:\?|%s)(?:, ?(?:\?|%s))*\)', re.IGNORECASE)
+
+# Функции с побочными эффектами, которые ROLLBACK TO SAVEPOINT не отменяет
+# (последовательности, advisory-блокировки, уведомления): такие SELECT не выполняются
+# повторно через EXPLAIN ANALYZE
+SIDE_EFFECT_RE = re.compile(
+    r'\b(nextval|setval|pg_notify|pg_(try_)?advisory_\w*lock\w*|pg_advisory_unlock\w*|'
+    r'set_config|txid_current|pg_current_xact_id|pg_cancel_backend|pg_terminate_backend|'
+    r'lo_\w+|dblink\w*)\s*\(',
+    re.IGNORECASE
+)
+
+# Статистика по запросам: отпечаток запроса (fingerprint_query) -> [calls, total_ms, max_ms]
+query_stats = {}
+stats_lock = threading.Lock()
+
+report_thread = None
+
+def load_settings():
+    """Read thresholds from the environment"""
+    global SLOW_QUERY_MS, EXPLAIN_SAMPLE_RATE, QUERY_REPORT_INTERVAL, QUERY_REPORT_TOP_N
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+    EXPLAIN_SAMPLE_RATE = float(os.getenv('EXPLAIN_SAMPLE_RATE', '0.1'))
+    QUERY_REPORT_INTERVAL = int(os.getenv('QUERY_REPORT_INTERVAL', '3600'))
+    QUERY_REPORT_TOP_N = int(os.getenv('QUERY_REPORT_TOP_N', '10'))
+
+def normalize_query(query) -> str:
+    """Collapse whitespace so that the same statement always gets the same key"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    return re.sub(r'\s+', ' ', str(query)).strip()
+
+def _skip_tuples(query: str, start: int) -> int:
+    """End of a comma-separated run of parenthesised tuples starting at `start`"""
+    end = start
+    i = start
+    while i < len(query) and query[i] == '(':
+        depth = 0
+        while i < len(query):
+            if query[i] == '(':
+                depth += 1
+            elif query[i] == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+            i += 1
+        if depth != 0:
+            return end
+        i += 1
+        end = i
+        while i < len(query) and query[i] in ' ,':
+            i += 1
+    return end
+
+def fingerprint_query(query: str) -> str:
+    """Bounded statistics key: literals become ?, VALUES and IN lists collapse to (...)"""
+    query = STRING_LITERAL_RE.sub('?', query)
+    query = NUMBER_LITERAL_RE.sub('?', query)
+    query = IN_LIST_RE.sub('IN (...)', query)
+    parts = []
+    pos = 0
+    for match in VALUES_RE.finditer(query):
+        if match.start() < pos:
+            continue
+        end = _skip_tuples(query, match.end())
+        if end == match.end():
+            continue
+        parts.append(query[pos:match.end()])
+        parts.append('(...)')
+        pos = end
+    parts.append(query[pos:])
+    return ''.join(parts)
+
+def truncate_query(query: str) -> str:
+    if len(query) > MAX_QUERY_LOG_LEN:
+        return query[:MAX_QUERY_LOG_LEN] + '...'
+    return query
+
+def record_query(query: str, elapsed_ms: float):
+    """Add a single execution to the aggregated statistics"""
+    with stats_lock:
+        stats = query_stats.get(query)
+        if stats is None and len(query_stats) >= MAX_TRACKED_QUERIES:
+            query = OTHER_QUERIES_KEY
+            stats = query_stats.get(query)
+        if stats is None:
+            query_stats[query] = [1, elapsed_ms, elapsed_ms]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed_ms
+            if elapsed_ms > stats[2]:
+                stats[2] = elapsed_ms
+
+def get_top_queries(n: Optional[int] = None) -> List[Tuple[str, int, float, float]]:
+    """Return the top N statements by total time as (query, calls, total_ms, max_ms)"""
+    if n is None:
+        n = QUERY_REPORT_TOP_N
+    with stats_lock:
+        rows = [(query, s[0], s[1], s[2]) for query, s in query_stats.items()]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:n]
+
+def reset_query_stats():
+    """Drop all collected statistics"""
+    with stats_lock:
+        query_stats.clear()
+
+def report_top_queries(n: Optional[int] = None):
+    """Log the top N statements by total time"""
+    top = get_top_queries(n)
+    if not top:
+        logger.info("Query report: no statements recorded")
+        return
+    lines = [f"Top {len(top)} queries by total time:"]
+    for query, calls, total_ms, max_ms in top:
+        lines.append(
+            f"  total={total_ms:.1f}ms calls={calls} avg={total_ms / calls:.1f}ms "
+            f"max={max_ms:.1f}ms | {query[:200]}"
+        )
+    logger.info("\n".join(lines))
+
+def _report_loop(interval: int):
+    while True:
+        time.sleep(interval)
+        try:
+            report_top_queries()
+        except Exception as e:
+            logger.error(f"Error writing query report: {e}")
+
+def start_report_thread(interval: Optional[int] = None):
+    """Start a daemon thread that periodically logs the top queries"""
+    global report_thread
+    if interval is None:
+        interval = QUERY_REPORT_INTERVAL
+    if report_thread is not None or interval <= 0:
+        return
+    report_thread = threading.Thread(target=_report_loop, args=(interval,), name='query-report', daemon=True)
+    report_thread.start()
+    logger.info(f"Query report thread started, interval {interval}s")
+
+class TimedCursor(extensions.cursor):
+    """Cursor that times every statement and logs the slow ones"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            normalized = normalize_query(query)
+            record_query(fingerprint_query(normalized), elapsed_ms)
+            if elapsed_ms >= SLOW_QUERY_MS:
+                self._log_slow_query(normalized, vars, elapsed_ms)
+
+    def _log_slow_query(self, query: str, vars, elapsed_ms: float):
+        params = repr(vars)
+        if len(params) > MAX_PARAMS_LOG_LEN:
+            params = params[:MAX_PARAMS_LOG_LEN] + '...'
+        logger.warning(f"Slow query ({elapsed_ms:.1f}ms): {truncate_query(query)} | params: {params}")
+
+        if random.random() < EXPLAIN_SAMPLE_RATE:
+            plan = self._explain(query, vars)
+            if plan:
+                logger.warning(f"Plan for slow query ({elapsed_ms:.1f}ms):\n{plan}")
+
+    def _explain(self, query: str, vars):
+        """Capture the plan of a slow statement on the same connection"""
+        # Серверные курсоры и упавшие транзакции не трогаем
+        if self.name is not None:
+            return None
+        conn = self.connection
+        if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+            return None
+
+        # EXPLAIN ANALYZE выполняет запрос повторно, поэтому для изменяющих запросов,
+        # SELECT с побочными эффектами и autocommit-соединений (где нет точки сохранения)
+        # снимаем только оценочный план
+        use_savepoint = not conn.autocommit
+        analyze = (
+            use_savepoint
+            and query.lstrip().upper().startswith('SELECT')
+            and not SIDE_EFFECT_RE.search(query)
+        )
+        if analyze:
+            explain = f"EXPLAIN (ANALYZE, BUFFERS) {query}"
+        else:
+            explain = f"EXPLAIN {query}"
+        cur = conn.cursor(cursor_factory=extensions.cursor)
+        try:
+            if use_savepoint:
+                cur.execute("SAVEPOINT query_stats_explain")
+            cur.execute(explain, vars)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+            if use_savepoint:
+                # Откатываем всё, что сделал повторный запуск, план уже прочитан
+                cur.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+                cur.execute("RELEASE SAVEPOINT query_stats_explain")
+            return plan
+        except Exception as e:
+            logger.error(f"Error capturing plan for slow query: {e}")
+            if use_savepoint:
+                try:
+                    cur.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+                except Exception:
+                    pass
+            return None
+        finally:
+            cur.close()
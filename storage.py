@@ -0,0 +1,381 @@
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, NamedTuple, Optional
+
+import db_config
+
+logger = logging.getLogger(__name__)
+
+# Подкаталог для временных файлов: запись идёт туда, затем атомарный rename
+TMP_DIR_NAME = '.tmp'
+
+# Временные файлы старше этого возраста остались от убитого процесса
+TMP_MAX_AGE_SECONDS = 3600
+
+class StoredFile(NamedTuple):
+    name: str
+    size: int
+    mtime: float
+
+def check_name(name: str) -> str:
+    """Reject file names that could escape the storage root"""
+    if not name or name in ('.', '..') or os.path.basename(name) != name or '/' in name or '\\' in name:
+        raise ValueError(f"Invalid image file name: {name!r}")
+    return name
+
+class StorageBackend:
+    """Base class for image storage backends"""
+
+    kind = 'base'
+
+    def save(self, name: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def load(self, name: str) -> bytes:
+        raise NotImplementedError
+
+    def read_head(self, name: str, size: int) -> bytes:
+        """First `size` bytes of a stored file"""
+        return self.load(name)[:size]
+
+    def stat(self, name: str) -> Optional[StoredFile]:
+        raise NotImplementedError
+
+    def delete(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def iter_files(self) -> Iterator[StoredFile]:
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        return self.stat(name) is not None
+
+    def location(self, name: str) -> str:
+        return name
+
+class LocalStorage(StorageBackend):
+    """Flat directory, every image directly in the root"""
+
+    kind = 'local'
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(self.root, TMP_DIR_NAME), exist_ok=True)
+        self.cleanup_tmp()
+
+    def cleanup_tmp(self) -> int:
+        """Remove half-written files of processes killed in the middle of save()"""
+        removed = 0
+        now = time.time()
+        tmp_dir = os.path.join(self.root, TMP_DIR_NAME)
+        with os.scandir(tmp_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False) and now - entry.stat().st_mtime > TMP_MAX_AGE_SECONDS:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} stale temporary file(s) from {tmp_dir}")
+        return removed
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, check_name(name))
+
+    def location(self, name: str) -> str:
+        return self.path(name)
+
+    def candidate_paths(self, name: str):
+        return [self.path(name)]
+
+    def save(self, name: str, data: bytes) -> None:
+        target = self.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = os.path.join(self.root, TMP_DIR_NAME, f"{name}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            # Файл появляется под своим именем только целиком
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def find(self, name: str) -> Optional[str]:
+        for path in self.candidate_paths(name):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def load(self, name: str) -> bytes:
+        path = self.find(name)
+        if path is None:
+            raise FileNotFoundError(name)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def read_head(self, name: str, size: int) -> bytes:
+        path = self.find(name)
+        if path is None:
+            raise FileNotFoundError(name)
+        with open(path, 'rb') as f:
+            return f.read(size)
+
+    def stat(self, name: str) -> Optional[StoredFile]:
+        path = self.find(name)
+        if path is None:
+            return None
+        st = os.stat(path)
+        return StoredFile(name, st.st_size, st.st_mtime)
+
+    def delete(self, name: str) -> bool:
+        deleted = False
+        for path in self.candidate_paths(name):
+            try:
+                os.remove(path)
+                deleted = True
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def iter_files(self) -> Iterator[StoredFile]:
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    yield StoredFile(entry.name, st.st_size, st.st_mtime)
+
+class ShardedLocalStorage(LocalStorage):
+    """Hashed two-level layout: root/ab/cd/name where abcd... is sha1(name)
+
+    Files that are still in the flat layout are found as well, so the backend
+    can be switched on before `python storage.py migrate` has finished.
+    """
+
+    kind = 'sharded'
+
+    def path(self, name: str) -> str:
+        digest = hashlib.sha1(check_name(name).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def candidate_paths(self, name: str):
+        return [self.path(name), os.path.join(self.root, check_name(name))]
+
+    def iter_files(self) -> Iterator[StoredFile]:
+        with os.scandir(self.root) as level1:
+            for shard1 in level1:
+                if shard1.name.startswith('.'):
+                    # Служебные каталоги .tmp и .gc
+                    continue
+                if shard1.is_file(follow_symlinks=False):
+                    # Файл ещё в плоской раскладке; если он уже есть и в шарде,
+                    # find() отдаёт шардовую копию, и она будет перечислена ниже
+                    if not os.path.isfile(self.path(shard1.name)):
+                        st = shard1.stat(follow_symlinks=False)
+                        yield StoredFile(shard1.name, st.st_size, st.st_mtime)
+                    continue
+                if len(shard1.name) != 2 or not shard1.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(shard1.path) as level2:
+                    for shard2 in level2:
+                        if not shard2.is_dir(follow_symlinks=False):
+                            continue
+                        with os.scandir(shard2.path) as entries:
+                            for entry in entries:
+                                if entry.is_file(follow_symlinks=False):
+                                    st = entry.stat(follow_symlinks=False)
+                                    yield StoredFile(entry.name, st.st_size, st.st_mtime)
+
+class S3Storage(StorageBackend):
+    """S3-compatible object storage (AWS S3, MinIO)"""
+
+    kind = 's3'
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, prefix: str = '',
+                 access_key: Optional[str] = None, secret_key: Optional[str] = None,
+                 region: Optional[str] = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package")
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region
+        )
+
+    def key(self, name: str) -> str:
+        return self.prefix + check_name(name)
+
+    def location(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+    def save(self, name: str, data: bytes) -> None:
+        # PUT в S3 атомарен: объект либо виден целиком, либо не виден вовсе
+        self.client.put_object(Bucket=self.bucket, Key=self.key(name), Body=data)
+
+    def load(self, name: str) -> bytes:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(name))
+        except self.client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise FileNotFoundError(name)
+            raise
+        return response['Body'].read()
+
+    def read_head(self, name: str, size: int) -> bytes:
+        # Ranged GET: не скачиваем объект целиком ради нескольких байт
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(name),
+                                              Range=f"bytes=0-{size - 1}")
+        except self.client_error as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('NoSuchKey', '404'):
+                raise FileNotFoundError(name)
+            if code == 'InvalidRange':  # пустой объект
+                return b''
+            raise
+        return response['Body'].read()
+
+    def stat(self, name: str) -> Optional[StoredFile]:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except self.client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound'):
+                return None
+            raise
+        return StoredFile(name, response['ContentLength'], response['LastModified'].timestamp())
+
+    def delete(self, name: str) -> bool:
+        existed = self.exists(name)
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        return existed
+
+    def iter_files(self) -> Iterator[StoredFile]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(self.prefix):]
+                if '/' in name:
+                    continue
+                yield StoredFile(name, obj['Size'], obj['LastModified'].timestamp())
+
+def make_storage(kind: str) -> StorageBackend:
+    """Build a backend of the given kind from the environment"""
+    db_config.configure()
+    if kind == 'local':
+        return LocalStorage(db_config.IMAGES_DIR)
+    if kind == 'sharded':
+        return ShardedLocalStorage(db_config.IMAGES_DIR)
+    if kind == 's3':
+        bucket = os.getenv('S3_BUCKET')
+        if not bucket:
+            raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        return S3Storage(
+            bucket,
+            endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+            prefix=os.getenv('S3_PREFIX', ''),
+            access_key=os.getenv('S3_ACCESS_KEY'),
+            secret_key=os.getenv('S3_SECRET_KEY'),
+            region=os.getenv('S3_REGION')
+        )
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+storage = None
+storage_lock = threading.Lock()
+
+def get_storage() -> StorageBackend:
+    """Return the configured storage backend (STORAGE_BACKEND=local|sharded|s3)"""
+    global storage
+    if storage is None:
+        with storage_lock:
+            if storage is None:
+                kind = os.getenv('STORAGE_BACKEND', 'local')
+                storage = make_storage(kind)
+                logger.info(f"Using '{kind}' image storage backend")
+    return storage
+
+def migrate_file(source: StorageBackend, target: StorageBackend, stored: StoredFile) -> str:
+    """Move a single file between backends, safe to repeat after an interruption"""
+    if isinstance(source, LocalStorage) and isinstance(target, LocalStorage) and source.root == target.root:
+        # Внутри одного каталога файл переносится переименованием, без копирования
+        source_path = source.path(stored.name)
+        target_path = target.path(stored.name)
+        if source_path == target_path:
+            return 'skipped'
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(source_path, target_path)
+        return 'moved'
+
+    existing = target.stat(stored.name)
+    if existing is None or existing.size != stored.size:
+        target.save(stored.name, source.load(stored.name))
+        result = 'copied'
+    else:
+        # Уже перенесён в прошлом запуске
+        result = 'skipped'
+    source.delete(stored.name)
+    return result
+
+def migrate(source_kind: str, target_kind: str, workers: int = 8) -> dict:
+    """Move every file from one backend to another in parallel
+
+    Moved files disappear from the source, so an interrupted run is resumed by
+    simply running the command again.
+    """
+    source = make_storage(source_kind)
+    target = make_storage(target_kind)
+    counts = {'moved': 0, 'copied': 0, 'skipped': 0, 'failed': 0}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for stored in source.iter_files():
+            futures[executor.submit(migrate_file, source, target, stored)] = stored.name
+            # Не держим в памяти задания для всего каталога сразу
+            if len(futures) >= workers * 100:
+                drain_futures(futures, counts)
+        drain_futures(futures, counts)
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Storage migration {source_kind} -> {target_kind} finished in {elapsed:.1f}s: {counts}")
+    return counts
+
+def drain_futures(futures: dict, counts: dict):
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            counts[future.result()] += 1
+        except Exception as e:
+            counts['failed'] += 1
+            logger.error(f"Failed to migrate image {name}: {e}")
+    futures.clear()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Управление хранилищем изображений")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="перенести файлы между хранилищами")
+    migrate_parser.add_argument('--from', dest='source', default='local', choices=['local', 'sharded', 's3'])
+    migrate_parser.add_argument('--to', dest='target', default='sharded', choices=['local', 'sharded', 's3'])
+    migrate_parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        result = migrate(args.source, args.target, args.workers)
+        if result['failed']:
+            raise SystemExit(1)
@@ -0,0 +1,618 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+from typing import Dict, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+from telegram import Bot, Update
+from telegram.error import NetworkError, TelegramError, TimedOut
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+import db_config
+from db_config import get_connection, release_connection
+
+logger = logging.getLogger(__name__)
+
+# Пространства ключей advisory-блокировок
+SHARD_LOCK_NAMESPACE = 727002
+CHAT_LOCK_NAMESPACE = 727003
+
+# Блокировка единственного получателя getUpdates (bot или poller)
+POLLING_LOCK_ID = 727004
+
+# Канал NOTIFY, в который poller сообщает номер шарда с новыми обновлениями
+UPDATES_CHANNEL = 'bot_updates'
+
+# Сколько ждать уведомления, прежде чем заглянуть в очередь ещё раз
+IDLE_POLL_SECONDS = 5
+
+# Таймаут long polling getUpdates, секунды
+POLL_TIMEOUT = 30
+
+# Как часто poller проверяет, что у каждого шарда есть воркер, секунды
+SHARD_CHECK_SECONDS = 60
+
+# Имена контрольных точек в bot_checkpoint
+SINGLE_CHECKPOINT = 'single'
+POLLER_CHECKPOINT = 'poller'
+
+def drain_seconds() -> float:
+    """How long a stopping process waits for the update in progress"""
+    return float(os.getenv('SHUTDOWN_DRAIN_SECONDS', '20'))
+
+def install_stop_signals() -> asyncio.Event:
+    """Return an event set by SIGTERM (docker stop) or SIGINT"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+def load_checkpoint(name: str) -> Optional[int]:
+    """Last update_id recorded under the name, None before the first one"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT update_id FROM bot_checkpoint WHERE name = %s", (name,))
+            row = cur.fetchone()
+        conn.rollback()
+    finally:
+        release_connection(conn)
+    return row[0] if row else None
+
+def write_checkpoint(cur, name: str, update_id: int):
+    """Record an update_id inside the caller's transaction, never moving backwards"""
+    cur.execute("""
+        INSERT INTO bot_checkpoint (name, update_id, updated_at)
+        VALUES (%s, %s, now())
+        ON CONFLICT (name) DO UPDATE
+        SET update_id = GREATEST(bot_checkpoint.update_id, EXCLUDED.update_id), updated_at = now()
+    """, (name, update_id))
+
+def save_checkpoint(name: str, update_id: int):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            write_checkpoint(cur, name, update_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+async def try_save_checkpoint(name: str, update_id: int) -> bool:
+    """Save a checkpoint without letting a database outage stop polling
+
+    A failed write is simply retried with the next update: the checkpoint only
+    moves forward, so a later update_id covers the missed one.
+    """
+    try:
+        await asyncio.to_thread(save_checkpoint, name, update_id)
+        return True
+    except Exception as e:
+        logger.error(f"Error saving checkpoint {name} at update {update_id}: {e}")
+        return False
+
+async def wait_or_stop(coro, stop: asyncio.Event):
+    """Run a coroutine unless stop is set first; returns (finished, result)"""
+    task = asyncio.ensure_future(coro)
+    stopper = asyncio.ensure_future(stop.wait())
+    done, _ = await asyncio.wait({task, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    stopper.cancel()
+    if task in done:
+        return True, task.result()
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    return False, None
+
+async def process_with_deadline(application: Application, update: Update, stop: asyncio.Event) -> bool:
+    """Process one update; after a stop request give it drain_seconds() to finish
+
+    Returns False if the update had to be cancelled, it is then left for redelivery.
+    """
+    task = asyncio.ensure_future(application.process_update(update))
+    finished, _ = await wait_or_stop(asyncio.shield(task), stop)
+    if finished:
+        return True
+    deadline = drain_seconds()
+    logger.info(f"Stop requested, waiting up to {deadline:.0f}s for update {update.update_id}")
+    try:
+        await asyncio.wait_for(task, deadline)
+        return True
+    except asyncio.TimeoutError:
+        logger.warning(f"Update {update.update_id} did not finish in {deadline:.0f}s and was cancelled")
+        return False
+
+async def acknowledge(bot: Bot, update_id: Optional[int]):
+    """Tell Telegram that updates up to update_id are handled, so they are not redelivered"""
+    if update_id is None:
+        return
+    try:
+        await bot.get_updates(offset=update_id + 1, timeout=0, limit=1)
+    except TelegramError as e:
+        logger.warning(f"Could not acknowledge updates up to {update_id}: {e}")
+
+def routing_key(update: Update) -> int:
+    """Chat id of the update, or the user id for updates without a chat (inline queries)"""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return 0
+
+def shard_for(key: int, shards: int) -> int:
+    """Shard that owns a chat; Python's % is never negative, so group chats are fine too"""
+    return key % shards
+
+class PostgresPersistence(BasePersistence):
+    """Keeps chat_data and conversation states in Postgres
+
+    A worker only loads the chats of its own shard, because only it will
+    ever receive their updates.
+    """
+
+    def __init__(self, shard: Optional[int] = None, shards: Optional[int] = None, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.shard = shard
+        self.shards = shards
+        # Записи, не прошедшие в update_persistence: ключ -> (функция записи, аргументы).
+        # Application.update_persistence() не пробрасывает ошибки, поэтому воркер
+        # проверяет их сам через write_pending() перед удалением обновления из очереди
+        self.pending_writes = {}
+
+    def owns(self, chat_id: int) -> bool:
+        return self.shard is None or shard_for(chat_id, self.shards) == self.shard
+
+    async def load_rows(self, query: str, args: Tuple = ()) -> list:
+        """Read stored state at startup, waiting for the database instead of failing initialize()"""
+        delay = 1
+        while True:
+            try:
+                conn = get_connection()
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(query, args)
+                        rows = cur.fetchall()
+                    conn.rollback()
+                    return rows
+                finally:
+                    release_connection(conn)
+            except Exception as e:
+                logger.warning(f"Cannot load bot state, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        rows = await self.load_rows("SELECT chat_id, data FROM bot_chat_data")
+        chat_data = {chat_id: data for chat_id, data in rows if self.owns(chat_id)}
+        logger.info(f"Loaded chat data for {len(chat_data)} chat(s)")
+        return chat_data
+
+    def write_chat_data(self, chat_id: int, data: dict):
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO bot_chat_data (chat_id, data, updated_at)
+                    VALUES (%s, %s, now())
+                    ON CONFLICT (chat_id) DO UPDATE SET data = EXCLUDED.data, updated_at = now()
+                """, (chat_id, Json(data)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            release_connection(conn)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        key = ('chat_data', chat_id)
+        try:
+            self.write_chat_data(chat_id, data)
+        except Exception as e:
+            # data - это сам словарь чата, повторная запись возьмёт его актуальное содержимое
+            self.pending_writes[key] = (self.write_chat_data, (chat_id, data))
+            logger.error(f"Error saving chat data for chat {chat_id}: {e}")
+            raise
+        self.pending_writes.pop(key, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bot_chat_data WHERE chat_id = %s", (chat_id,))
+            conn.commit()
+        finally:
+            release_connection(conn)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        # Чат всегда обрабатывается одним и тем же воркером, его копия в памяти актуальна
+        pass
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        rows = await self.load_rows("SELECT key, state FROM bot_conversation WHERE name = %s", (name,))
+        conversations = {}
+        for key, state in rows:
+            key = tuple(json.loads(key))
+            if not key or self.owns(key[0]):
+                conversations[key] = state
+        return conversations
+
+    def write_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                if new_state is None:
+                    cur.execute("DELETE FROM bot_conversation WHERE name = %s AND key = %s", (name, json.dumps(key)))
+                else:
+                    cur.execute("""
+                        INSERT INTO bot_conversation (name, key, state, updated_at)
+                        VALUES (%s, %s, %s, now())
+                        ON CONFLICT (name, key) DO UPDATE SET state = EXCLUDED.state, updated_at = now()
+                    """, (name, json.dumps(key), Json(new_state)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            release_connection(conn)
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        pending_key = ('conversation', name, key)
+        try:
+            self.write_conversation(name, key, new_state)
+        except Exception as e:
+            self.pending_writes[pending_key] = (self.write_conversation, (name, key, new_state))
+            logger.error(f"Error saving conversation {name} {key}: {e}")
+            raise
+        self.pending_writes.pop(pending_key, None)
+
+    def write_pending(self):
+        """Retry the writes that failed in update_persistence; raises while they still fail"""
+        for key, (write, args) in list(self.pending_writes.items()):
+            write(*args)
+            self.pending_writes.pop(key, None)
+
+    # Данные пользователей, бота и callback_data не используются
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+def enqueue_updates(updates, shards: int):
+    """Store fetched updates in the shared queue and wake up the owning workers"""
+    rows = []
+    for update in updates:
+        key = routing_key(update)
+        rows.append((update.update_id, shard_for(key, shards), key, Json(update.to_dict())))
+
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO bot_update_queue (update_id, shard, chat_key, payload)
+                VALUES %s
+                ON CONFLICT (update_id) DO NOTHING
+            """, rows)
+            for shard in sorted({row[1] for row in rows}):
+                cur.execute("SELECT pg_notify(%s, %s)", (UPDATES_CHANNEL, str(shard)))
+            # Контрольная точка в той же транзакции: после рестарта poller не поставит
+            # в очередь повторно то, что воркеры могли уже обработать и удалить
+            write_checkpoint(cur, POLLER_CHECKPOINT, max(row[0] for row in rows))
+        # NOTIFY доставляется только после COMMIT, когда строки уже видны воркерам
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+def unowned_shards(shards: int) -> Dict[int, int]:
+    """Shards whose advisory lock no worker holds, with the number of updates queued for them"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            # Блокировка из двух int4-ключей видна в pg_locks как classid/objid с objsubid = 2
+            cur.execute("""
+                SELECT objid::bigint
+                FROM pg_locks
+                WHERE locktype = 'advisory' AND granted AND objsubid = 2 AND classid = %s
+                  AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+            """, (SHARD_LOCK_NAMESPACE,))
+            owned = {row[0] for row in cur.fetchall()}
+            missing = [shard for shard in range(shards) if shard not in owned]
+            queued = {}
+            if missing:
+                cur.execute("""
+                    SELECT shard, count(*)
+                    FROM bot_update_queue
+                    WHERE shard = ANY(%s)
+                    GROUP BY shard
+                """, (missing,))
+                queued = dict(cur.fetchall())
+        conn.rollback()
+    finally:
+        release_connection(conn)
+    return {shard: queued.get(shard, 0) for shard in missing}
+
+async def watch_shards(shards: int, stop: asyncio.Event):
+    """Periodically report shards without a worker: their chats get no replies"""
+    while True:
+        finished, _ = await wait_or_stop(asyncio.sleep(SHARD_CHECK_SECONDS), stop)
+        if not finished:
+            return
+        try:
+            missing = await asyncio.to_thread(unowned_shards, shards)
+        except Exception as e:
+            logger.warning(f"Error checking shard owners: {e}")
+            continue
+        if missing:
+            details = ', '.join(f"{shard} ({queued} queued)" for shard, queued in sorted(missing.items()))
+            logger.error(
+                f"No worker holds shard(s) {details} of {shards}: "
+                f"run as many workers as WORKER_SHARDS or restart the failed ones"
+            )
+
+async def fetch_updates(bot: Bot, offset: Optional[int]):
+    try:
+        return await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES)
+    except (NetworkError, TimedOut) as e:
+        logger.warning(f"Error fetching updates, retrying: {e}")
+        await asyncio.sleep(1)
+        return []
+
+async def run_poller(bot: Bot, shards: int):
+    """Fetch updates from Telegram and distribute them over worker shards
+
+    Telegram considers updates delivered only when the next getUpdates asks for a
+    larger offset, and that happens after they are committed to the queue.
+    """
+    stop = install_stop_signals()
+    async with bot:
+        last_queued = await asyncio.to_thread(load_checkpoint, POLLER_CHECKPOINT)
+        offset = last_queued + 1 if last_queued is not None else None
+        logger.info(f"Poller started for {shards} shard(s), resuming after update {last_queued}")
+        watcher = asyncio.ensure_future(watch_shards(shards, stop))
+        try:
+            while not stop.is_set():
+                finished, updates = await wait_or_stop(fetch_updates(bot, offset), stop)
+                if not finished:
+                    break
+                fresh = [update for update in updates if last_queued is None or update.update_id > last_queued]
+                if fresh:
+                    await asyncio.to_thread(enqueue_updates, fresh, shards)
+                    last_queued = fresh[-1].update_id
+                    logger.info(f"Queued {len(fresh)} update(s)")
+                if last_queued is not None:
+                    offset = last_queued + 1
+        finally:
+            watcher.cancel()
+            await acknowledge(bot, last_queued)
+            logger.info(f"Poller stopped after update {last_queued}")
+
+async def run_single(application: Application):
+    """Poll and process updates in one process, checkpointing each processed update
+
+    Replaces Application.run_polling so that a stop signal drains the update in
+    progress with a deadline. Updates fetched but not processed are not
+    acknowledged and come back after the restart; updates processed before the
+    restart are usually recognised by the checkpoint and skipped. The handler's
+    own commit and the checkpoint are separate transactions, so a crash between
+    them, or a checkpoint that could not be written, means the update is
+    processed once more.
+    """
+    stop = install_stop_signals()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    bot = application.bot
+    await bot.delete_webhook()
+
+    try:
+        last_done = await asyncio.to_thread(load_checkpoint, SINGLE_CHECKPOINT)
+    except Exception as e:
+        # База может быть недоступна при старте: продолжаем без контрольной точки,
+        # Telegram сам повторит неподтверждённые обновления, а database_guard
+        # ответит пользователям сообщением о техработах
+        logger.error(f"Error loading checkpoint {SINGLE_CHECKPOINT}, polling without it: {e}")
+        last_done = None
+    offset = last_done + 1 if last_done is not None else None
+    logger.info(f"Polling started, resuming after update {last_done}")
+    try:
+        while not stop.is_set():
+            finished, updates = await wait_or_stop(fetch_updates(bot, offset), stop)
+            if not finished:
+                break
+            for update in updates:
+                if last_done is not None and update.update_id <= last_done:
+                    logger.info(f"Skipping update {update.update_id}, already processed")
+                    continue
+                if stop.is_set() or not await process_with_deadline(application, update, stop):
+                    break
+                await application.update_persistence()
+                await try_save_checkpoint(SINGLE_CHECKPOINT, update.update_id)
+                last_done = update.update_id
+            if last_done is not None:
+                offset = last_done + 1
+    finally:
+        await acknowledge(bot, last_done)
+        # stop() дожидается задач create_task, shutdown() сохраняет chat_data и диалоги
+        await application.stop()
+        await application.shutdown()
+        logger.info(f"Polling stopped after update {last_done}")
+
+def claim_polling():
+    """Take the lock that only one getUpdates consumer (single bot or poller) may hold
+
+    Returns the connection holding it, or None if the database is unreachable:
+    the check is then skipped rather than delaying startup.
+    """
+    try:
+        conn = psycopg2.connect(**db_config.DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        logger.warning(f"Cannot check for another polling process, database is unavailable: {e}")
+        return None
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (POLLING_LOCK_ID,))
+        if cur.fetchone()[0]:
+            return conn
+    conn.close()
+    raise RuntimeError("Another bot or poller is already polling Telegram, stop it first")
+
+def claim_shard(shards: int, requested: str = 'auto') -> Tuple[int, object]:
+    """Take the session advisory lock of a shard; returns (shard, connection holding the lock)
+
+    With requested='auto' the first free shard is taken, so identical worker
+    containers can simply be scaled up to `shards` replicas.
+    """
+    candidates = range(shards) if requested == 'auto' else [int(requested)]
+    conn = psycopg2.connect(**db_config.DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for shard in candidates:
+            cur.execute("SELECT pg_try_advisory_lock(%s, %s)", (SHARD_LOCK_NAMESPACE, shard))
+            if cur.fetchone()[0]:
+                logger.info(f"Claimed shard {shard} of {shards}")
+                return shard, conn
+    conn.close()
+    raise RuntimeError(f"No free shard among {list(candidates)} of {shards}")
+
+def take_next_update(conn, shard: int):
+    """Lock the oldest queued update of the shard together with its chat"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT update_id, chat_key, payload
+            FROM bot_update_queue
+            WHERE shard = %s
+            ORDER BY update_id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """, (shard,))
+        row = cur.fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        # Блокировка чата на время обработки защищает от параллельной обработки
+        # при смене числа шардов во время выкатки
+        cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (CHAT_LOCK_NAMESPACE, row[1] % 2147483647))
+        return row
+
+def finish_update(conn, update_id: int):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM bot_update_queue WHERE update_id = %s", (update_id,))
+    conn.commit()
+
+async def save_chat_state(application: Application, stop: asyncio.Event) -> bool:
+    """Write chat data and conversation states, retrying until they are stored
+
+    Returns False if a stop was requested first; the update then stays in the
+    queue and is processed again from the last stored state.
+    """
+    await application.update_persistence()
+    delay = 1
+    while True:
+        try:
+            application.persistence.write_pending()
+            return True
+        except Exception as e:
+            logger.warning(f"Chat state not saved, retrying in {delay}s: {e}")
+        finished, _ = await wait_or_stop(asyncio.sleep(delay), stop)
+        if not finished:
+            return False
+        delay = min(delay * 2, 30)
+
+async def run_worker(application: Application, shard: int, lock_conn):
+    """Process the updates of one shard in update_id order"""
+    queue_conn = psycopg2.connect(**db_config.DB_CONFIG)
+    wake = asyncio.Event()
+
+    # Ждём NOTIFY на соединении, которое держит блокировку шарда
+    with lock_conn.cursor() as cur:
+        cur.execute(f"LISTEN {UPDATES_CHANNEL}")
+
+    def on_notify():
+        lock_conn.poll()
+        while lock_conn.notifies:
+            notify = lock_conn.notifies.pop(0)
+            if notify.payload == str(shard):
+                wake.set()
+
+    loop = asyncio.get_running_loop()
+    loop.add_reader(lock_conn.fileno(), on_notify)
+
+    async def wait_for_work():
+        try:
+            await asyncio.wait_for(wake.wait(), IDLE_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
+
+    stop = install_stop_signals()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    logger.info(f"Worker for shard {shard} started")
+    try:
+        while not stop.is_set():
+            row = take_next_update(queue_conn, shard)
+            if row is None:
+                await wait_or_stop(wait_for_work(), stop)
+                continue
+
+            update_id, _, payload = row
+            try:
+                update = Update.de_json(payload, application.bot)
+                if not await process_with_deadline(application, update, stop):
+                    # Строка остаётся в очереди и будет обработана после перезапуска
+                    queue_conn.rollback()
+                    break
+                # Обновление уходит из очереди только после того, как состояние чата записано
+                if not await save_chat_state(application, stop):
+                    queue_conn.rollback()
+                    break
+                finish_update(queue_conn, update_id)
+            except Exception:
+                queue_conn.rollback()
+                raise
+    finally:
+        loop.remove_reader(lock_conn.fileno())
+        await application.stop()
+        await application.shutdown()
+        queue_conn.close()
@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from psycopg2.extras import execute_values
+
+import db_config
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые можно менять через update_landmark_field (имя поля подставляется в SQL)
+UPDATABLE_FIELDS = {'name', 'address', 'category', 'description', 'history', 'images_name', 'location'}
+
+# Маркер остановки потока записи
+STOP = object()
+
+class Mutation:
+    """A queued landmark write and the future its handler is waiting on"""
+
+    __slots__ = ('kind', 'landmark_id', 'field', 'value', 'session', 'future')
+
+    def __init__(self, kind: str, landmark_id: Optional[int] = None, field: Optional[str] = None, value=None):
+        self.kind = kind
+        self.landmark_id = landmark_id
+        self.field = field
+        self.value = value
+        self.session = db_config.current_session.get()
+        self.future = Future()
+
+    @property
+    def group(self):
+        return self.kind, self.field
+
+class WriteBehindQueue:
+    """Collects landmark mutations and commits them in batches from one thread
+
+    A single writer thread applies batches in submission order, so mutations of
+    the same landmark are never reordered. The bounded queue gives back-pressure:
+    when the database falls behind, submitters wait instead of piling up memory.
+    Each submitter gets its result only after the batch has been committed.
+    """
+
+    def __init__(self, max_batch: int = 100, flush_interval: float = 0.05, max_queue: int = 1000):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        self.thread.start()
+        logger.info(
+            f"Write-behind started: batch {self.max_batch}, interval {self.flush_interval * 1000:.0f}ms, "
+            f"queue {self.queue.maxsize}"
+        )
+
+    def stop(self, timeout: Optional[float] = None):
+        """Flush everything already queued and stop the writer thread"""
+        if self.thread is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            # База не успевает: ждущие обработчики получают ошибку, а не зависают
+            dropped = self.abandon_queued()
+            logger.warning(f"Write-behind queue still full at shutdown, dropped {dropped} mutation(s)")
+            try:
+                self.queue.put_nowait(STOP)
+            except queue.Full:
+                pass
+        self.thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if self.thread.is_alive():
+            logger.warning("Write-behind thread did not finish flushing in time")
+        else:
+            logger.info("Write-behind queue flushed and stopped")
+        self.thread = None
+
+    def abandon_queued(self) -> int:
+        """Fail every mutation still waiting in the queue, returns how many were dropped"""
+        dropped = 0
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return dropped
+            if item is STOP or item.future.done():
+                continue
+            item.future.set_exception(db_config.DatabaseUnavailable("Write-behind queue stopped before the write"))
+            dropped += 1
+
+    def submit(self, mutation: Mutation, timeout: Optional[float] = None) -> Future:
+        """Queue a mutation, blocks while the queue is full"""
+        self.queue.put(mutation, timeout=timeout)
+        return mutation.future
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.flush(batch)
+
+        # Дописываем то, что успели поставить в очередь до остановки
+        leftover = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not STOP:
+                leftover.append(item)
+        if leftover:
+            self.flush(leftover)
+
+    def flush(self, batch: List[Mutation]):
+        """Apply a batch in one transaction, falling back to one-by-one writes on error"""
+        started = time.monotonic()
+        try:
+            results = self.apply_batch(batch)
+        except Exception as e:
+            logger.warning(f"Batch of {len(batch)} mutation(s) failed, retrying one by one: {e}")
+            self.apply_individually(batch)
+            return
+
+        for mutation, result in zip(batch, results):
+            if result:
+                db_config.mark_session_write(mutation.session)
+                self.notify(mutation, result)
+            mutation.future.set_result(bool(result))
+        logger.info(f"Flushed {len(batch)} mutation(s) in {(time.monotonic() - started) * 1000:.1f}ms")
+
+    def notify(self, mutation: Mutation, result):
+        if mutation.kind == 'insert':
+            db_config.notify_change('insert', result, {
+                'name': mutation.value['name'],
+                'category': mutation.value['category'],
+                'images_name': mutation.value['images_name'],
+            })
+        elif mutation.kind == 'update':
+            db_config.notify_change('update', mutation.landmark_id, {mutation.field: mutation.value})
+        elif mutation.kind == 'delete':
+            db_config.notify_change('delete', mutation.landmark_id, {})
+
+    def apply_batch(self, batch: List[Mutation]) -> list:
+        """Run consecutive mutations of the same kind as one statement, in order"""
+        results = [False] * len(batch)
+        conn = db_config.get_connection()
+        try:
+            with conn.cursor() as cur:
+                start = 0
+                while start < len(batch):
+                    end = start + 1
+                    ids = {batch[start].landmark_id}
+                    names = {batch[start].value} if batch[start].group == ('update', 'name') else set()
+                    # Одна и та же запись (или одно новое имя) не должна дважды попасть
+                    # в один UPDATE ... FROM VALUES, иначе порядок применения не определён
+                    while end < len(batch) and batch[end].group == batch[start].group:
+                        if batch[end].kind == 'update':
+                            if batch[end].landmark_id in ids or batch[end].value in names:
+                                break
+                            if batch[end].field == 'name':
+                                names.add(batch[end].value)
+                        ids.add(batch[end].landmark_id)
+                        end += 1
+                    run = batch[start:end]
+                    for offset, result in enumerate(self.apply_run(cur, run)):
+                        results[start + offset] = result
+                    start = end
+            conn.commit()
+            return results
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            db_config.release_connection(conn)
+
+    def apply_run(self, cur, run: List[Mutation]) -> list:
+        kind, field = run[0].group
+        if kind == 'insert':
+            return self.insert_run(cur, run)
+        if kind == 'delete':
+            cur.execute("""
+                UPDATE landmark
+                SET deleted_at = now()
+                WHERE id = ANY(%s) AND deleted_at IS NULL
+                RETURNING id
+            """, ([m.landmark_id for m in run],))
+            deleted = {row[0] for row in cur.fetchall()}
+            return [m.landmark_id in deleted for m in run]
+        if field == 'location':
+            rows = execute_values(cur, """
+                UPDATE landmark AS l
+                SET location = ST_SetSRID(ST_MakePoint(v.lon, v.lat), 4326)::geography
+                FROM (VALUES %s) AS v(id, lat, lon)
+                WHERE l.id = v.id AND l.deleted_at IS NULL
+                RETURNING l.id
+            """, [(m.landmark_id, m.value[0], m.value[1]) for m in run],
+                template="(%s::int, %s::float8, %s::float8)", page_size=len(run), fetch=True)
+        elif field == 'name':
+            rows = execute_values(cur, """
+                UPDATE landmark AS l
+                SET name = v.value
+                FROM (VALUES %s) AS v(id, value)
+                WHERE l.id = v.id AND l.deleted_at IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM landmark o WHERE o.name = v.value AND o.deleted_at IS NULL)
+                RETURNING l.id
+            """, [(m.landmark_id, m.value) for m in run],
+                template="(%s::int, %s::text)", page_size=len(run), fetch=True)
+        else:
+            rows = execute_values(cur, f"""
+                UPDATE landmark AS l
+                SET {field} = v.value
+                FROM (VALUES %s) AS v(id, value)
+                WHERE l.id = v.id AND l.deleted_at IS NULL
+                RETURNING l.id
+            """, [(m.landmark_id, m.value) for m in run],
+                template="(%s::int, %s::text)", page_size=len(run), fetch=True)
+        updated = {row[0] for row in rows}
+        return [m.landmark_id in updated for m in run]
+
+    def insert_run(self, cur, run: List[Mutation]) -> list:
+        """Insert new landmarks, skipping names that already exist; returns new ids or False"""
+        first_by_name = {}
+        for i, m in enumerate(run):
+            first_by_name.setdefault(m.value['name'], i)
+        unique = [run[i] for i in sorted(first_by_name.values())]
+
+        rows = execute_values(cur, """
+            INSERT INTO landmark (id, name, address, category, description, history, location, images_name, photo)
+            SELECT nextval('landmark_id_seq'), v.name, v.address, v.category, v.description, v.history,
+                   ST_SetSRID(ST_MakePoint(v.lon, v.lat), 4326)::geography, v.images_name, NULL
+            FROM (VALUES %s) AS v(name, address, category, description, history, lat, lon, images_name)
+            WHERE NOT EXISTS (SELECT 1 FROM landmark l WHERE l.name = v.name AND l.deleted_at IS NULL)
+            RETURNING id, name
+        """, [
+            (m.value['name'], m.value['address'], m.value['category'], m.value['description'],
+             m.value['history'], m.value['latitude'], m.value['longitude'], m.value['images_name'])
+            for m in unique
+        ], template="(%s::text, %s::text, %s::text, %s::text, %s::text, %s::float8, %s::float8, %s::text)",
+            page_size=len(unique), fetch=True)
+        ids_by_name = {name: landmark_id for landmark_id, name in rows}
+
+        results = []
+        for i, m in enumerate(run):
+            name = m.value['name']
+            results.append(ids_by_name.get(name, False) if first_by_name[name] == i else False)
+        return results
+
+    def apply_individually(self, batch: List[Mutation]):
+        """Fallback: apply each mutation in its own transaction to isolate the failing one"""
+        for mutation in batch:
+            token = db_config.current_session.set(mutation.session)
+            try:
+                if mutation.kind == 'insert':
+                    result = db_config.save_landmark(**mutation.value)
+                elif mutation.kind == 'update':
+                    result = db_config.update_landmark_field(mutation.landmark_id, mutation.field, mutation.value)
+                else:
+                    result = db_config.delete_landmark_by_id(mutation.landmark_id)
+                mutation.future.set_result(bool(result))
+            except db_config.DatabaseUnavailable as e:
+                # Обработчик ответит сообщением о техработах, как и без очереди
+                mutation.future.set_exception(e)
+            except Exception as e:
+                logger.error(f"Mutation {mutation.kind} for landmark {mutation.landmark_id} failed: {e}")
+                mutation.future.set_result(False)
+            finally:
+                db_config.current_session.reset(token)
+
+write_queue = None
+
+def enabled() -> bool:
+    return write_queue is not None
+
+def start_write_behind():
+    """Start write-behind mode if WRITE_BEHIND=1"""
+    global write_queue
+    if os.getenv('WRITE_BEHIND', '0') != '1' or write_queue is not None:
+        return
+    write_queue = WriteBehindQueue(
+        max_batch=int(os.getenv('WRITE_BEHIND_BATCH', '100')),
+        flush_interval=float(os.getenv('WRITE_BEHIND_FLUSH_MS', '50')) / 1000,
+        max_queue=int(os.getenv('WRITE_BEHIND_MAX_QUEUE', '1000'))
+    )
+    write_queue.start()
+
+def stop_write_behind(timeout: Optional[float] = None):
+    """Flush pending mutations and stop the writer thread"""
+    global write_queue
+    if write_queue is not None:
+        write_queue.stop(timeout)
+        write_queue = None
+
+async def submit(mutation: Mutation) -> bool:
+    """Queue a mutation and wait until its batch is committed"""
+    put_timeout = float(os.getenv('WRITE_BEHIND_PUT_TIMEOUT', '10'))
+    try:
+        future = await asyncio.to_thread(write_queue.submit, mutation, put_timeout)
+    except queue.Full:
+        logger.error(f"Write-behind queue is full, rejecting {mutation.kind} for landmark {mutation.landmark_id}")
+        return False
+    return await asyncio.wrap_future(future)
+
+async def save_landmark(name: str, address: str, category: str, description: str,
+                        history: str, latitude: float, longitude: float, images_name: str) -> bool:
+    """Save a new landmark, through the write-behind queue when it is enabled"""
+    values = dict(name=name, address=address, category=category, description=description,
+                  history=history, latitude=latitude, longitude=longitude, images_name=images_name)
+    if not enabled():
+        return db_config.save_landmark(**values)
+    return await submit(Mutation('insert', value=values))
+
+async def update_landmark_field(landmark_id: int, field: str, value) -> bool:
+    """Update a landmark field, through the write-behind queue when it is enabled"""
+    if field not in UPDATABLE_FIELDS:
+        raise ValueError(f"Field {field!r} cannot be updated")
+    if not enabled():
+        return db_config.update_landmark_field(landmark_id, field, value)
+    return await submit(Mutation('update', landmark_id=landmark_id, field=field, value=value))
+
+async def delete_landmark_by_id(landmark_id: int) -> bool:
+    """Soft-delete a landmark, through the write-behind queue when it is enabled"""
+    if not enabled():
+        return db_config.delete_landmark_by_id(landmark_id)
+    return await submit(Mutation('delete', landmark_id=landmark_id))